@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+#
+# Measures the memory used by the HeaderContext that parse_header produces
+# for a synthetic header with many methods, and the peak memory used while
+# parsing it.
+#
+#   python benchmarks/context_memory.py [--classes N] [--methods N]
+#
+
+import argparse
+import gc
+import pathlib
+import pickle
+import tempfile
+import time
+import tracemalloc
+
+from cxxheaderparser.options import ParserOptions
+
+from robotpy_build.autowrap.cxxparser import parse_header
+from robotpy_build.autowrap.generator_data import GeneratorData
+from robotpy_build.config.autowrap_yml import AutowrapConfigYaml
+
+# Each method uses one of these signatures, which includes out parameters
+# (which generate lambdas) and virtual methods (which generate trampolines)
+signatures = [
+    "int {name}(int a, int b);",
+    "const std::string &{name}(const std::string &s) const;",
+    "void {name}(double *out);",
+    "virtual bool {name}(std::vector<int> values, size_t count);",
+    "static std::shared_ptr<Thing> {name}(Thing &thing, float scale = 1.0f);",
+]
+
+
+def make_header(nclasses: int, nmethods: int) -> str:
+    lines = ["#pragma once", "", "namespace bench {", ""]
+    for c in range(nclasses):
+        lines += [f"class Class{c} {{", "public:", f"  Class{c}();"]
+        for m in range(nmethods):
+            sig = signatures[m % len(signatures)]
+            lines.append("  /** Does something */")
+            lines.append("  " + sig.format(name=f"method{m}"))
+        lines += ["};", ""]
+    lines += ["}  // namespace bench", ""]
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--classes", type=int, default=100)
+    parser.add_argument("--methods", type=int, default=100, help="Per class")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = pathlib.Path(tmpdir)
+        header = root / "bench.h"
+        header.write_text(make_header(args.classes, args.methods))
+
+        gendata = GeneratorData(AutowrapConfigYaml())
+
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        hctx = parse_header("bench", header, root, gendata, ParserOptions(), {}, False)
+        elapsed = time.perf_counter() - start
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    nmethods = sum(len(c.wrapped_public_methods) for c in hctx.classes)
+    print(f"{len(hctx.classes)} classes, {nmethods} methods")
+    print(f"parse time:         {elapsed:8.2f}s (traced)")
+    print(f"HeaderContext:      {retained / 1e6:8.2f}MB")
+    print(f"peak while parsing: {peak / 1e6:8.2f}MB")
+
+    data = pickle.dumps(hctx, protocol=pickle.HIGHEST_PROTOCOL)
+    pickle.loads(data)
+    print(f"pickled:            {len(data) / 1e6:8.2f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+#
+# Measures how long RenderBuffer takes to build the output of the renderers.
+# The headers from the test project are parsed, the calls that the renderers
+# make to RenderBuffer are recorded, and then the calls are replayed so that
+# the time spent in the buffer can be measured separately from the renderers.
+#
+#   python benchmarks/render_buffer.py [--number N] [header.h ...]
+#
+
+import argparse
+import contextlib
+import inspect
+import pathlib
+import time
+import typing
+
+from cxxheaderparser.options import ParserOptions
+import tomli
+
+from robotpy_build.autowrap import (
+    render_cls_rpy_include,
+    render_tmpl_inst,
+    render_wrapped,
+)
+from robotpy_build.autowrap.buffer import RenderBuffer
+from robotpy_build.autowrap.context import HeaderContext
+from robotpy_build.autowrap.cxxparser import parse_header
+from robotpy_build.autowrap.generator_data import GeneratorData
+from robotpy_build.config.autowrap_yml import AutowrapConfigYaml
+from robotpy_build.preprocessor import make_pcpp_preprocessor
+
+cpp_root = pathlib.Path(__file__).parent.parent / "tests" / "cpp"
+ft_root = cpp_root / "rpytest" / "ft"
+
+Call = typing.Tuple[str, typing.Tuple[typing.Any, ...]]
+
+
+def get_test_headers() -> typing.Dict[str, pathlib.Path]:
+    """Returns the headers wrapped by the rpytest.ft package of the test project"""
+    with open(cpp_root / "pyproject.toml.tmpl", "rb") as fp:
+        cfg = tomli.load(fp)["tool"]["robotpy-build"]["wrappers"]["rpytest.ft"]
+
+    headers = {}
+    for item in cfg["generate"]:
+        for name, header in item.items():
+            headers[name] = ft_root / "include" / header
+    return headers
+
+
+def parse(name: str, header: pathlib.Path, header_root: pathlib.Path) -> HeaderContext:
+    data_path = cpp_root / "gen" / "ft" / f"{name}.yml"
+    if data_path.exists():
+        data = AutowrapConfigYaml.from_file(data_path)
+    else:
+        data = AutowrapConfigYaml()
+
+    popts = ParserOptions(
+        preprocessor=make_pcpp_preprocessor(
+            defines=[],
+            include_paths=[str(header_root)],
+            encoding=data.encoding,
+            deps={},
+        )
+    )
+    return parse_header(
+        name, header, header_root, GeneratorData(data), popts, {}, False
+    )
+
+
+def render_all(
+    hctx: HeaderContext, new_buffer: typing.Callable[[], RenderBuffer] = RenderBuffer
+) -> typing.List[RenderBuffer]:
+    """Renders every output for a header, returns the buffers"""
+    r = new_buffer()
+    render_wrapped.render_wrapped_cpp(r, hctx)
+    buffers = [r]
+    for cls in hctx.classes:
+        if cls.template or cls.trampoline:
+            r = new_buffer()
+            render_cls_rpy_include.render_cls_rpy_include_hpp(r, hctx, cls)
+            buffers.append(r)
+    if hctx.template_instances:
+        r = new_buffer()
+        render_tmpl_inst.render_template_inst_hpp(r, hctx)
+        buffers.append(r)
+        for tmpl_data in hctx.template_instances:
+            r = new_buffer()
+            render_tmpl_inst.render_template_inst_cpp(r, hctx, tmpl_data)
+            buffers.append(r)
+    return buffers
+
+
+def record(hctxs: typing.List[HeaderContext]) -> typing.List[typing.List[Call]]:
+    """Returns the calls made to each RenderBuffer used by the renderers"""
+    traces: typing.List[typing.List[Call]] = []
+
+    class RecordingBuffer(RenderBuffer):
+        def __init__(self) -> None:
+            super().__init__()
+            self.calls: typing.List[Call] = []
+            traces.append(self.calls)
+
+        def rel_indent(self, spaces: int):
+            self.calls.append(("rel_indent", (spaces,)))
+            super().rel_indent(spaces)
+
+        @contextlib.contextmanager
+        def indent(self, spaces: int = 2):
+            self.calls.append(("rel_indent", (spaces,)))
+            with super().indent(spaces):
+                yield
+            self.calls.append(("rel_indent", (-spaces,)))
+
+        def writeln(self, s: str = ""):
+            self.calls.append(("writeln", (s,)))
+            super().writeln(s)
+
+        def write_trim(self, s: str):
+            self.calls.append(("write_trim", (s,)))
+            super().write_trim(s)
+
+    for hctx in hctxs:
+        render_all(hctx, RecordingBuffer)
+
+    return traces
+
+
+class NullBuffer:
+    """Used to measure the overhead of replaying calls"""
+
+    def rel_indent(self, spaces: int):
+        pass
+
+    def writeln(self, s: str = ""):
+        pass
+
+    def write_trim(self, s: str):
+        pass
+
+    def getvalue(self) -> str:
+        return ""
+
+
+class CleandocBuffer(RenderBuffer):
+    """RenderBuffer.write_trim before it avoided inspect.cleandoc"""
+
+    def write_trim(self, s: str):
+        self._write_lines(inspect.cleandoc(s).splitlines(False))
+
+
+def replay(
+    traces: typing.List[typing.List[Call]], cls: typing.Any = RenderBuffer
+) -> int:
+    size = 0
+    for calls in traces:
+        r = cls()
+        for name, args in calls:
+            getattr(r, name)(*args)
+        size += len(r.getvalue())
+    return size
+
+
+def best_of(number: int, fn: typing.Callable[[], typing.Any]) -> float:
+    best = float("inf")
+    for _ in range(number):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("headers", nargs="*", type=pathlib.Path)
+    parser.add_argument("--number", type=int, default=20, help="Repetitions")
+    args = parser.parse_args()
+
+    if args.headers:
+        hctxs = [parse(h.stem, h, h.parent) for h in args.headers]
+    else:
+        include = ft_root / "include"
+        hctxs = [parse(n, h, include) for n, h in get_test_headers().items()]
+
+    traces = record(hctxs)
+    ncalls = sum(len(calls) for calls in traces)
+    size = replay(traces)
+    print(f"{len(hctxs)} headers, {len(traces)} outputs, {ncalls} calls, {size} bytes")
+
+    overhead = best_of(args.number, lambda: replay(traces, NullBuffer))
+    t = best_of(args.number, lambda: replay(traces))
+    print(f"RenderBuffer replay: {t * 1000:8.2f}ms ({overhead * 1000:.2f}ms overhead)")
+
+    # only the write_trim calls, compared with trimming using inspect.cleandoc
+    trim_traces = [[c for c in calls if c[0] != "writeln"] for calls in traces]
+    assert replay(trim_traces) == replay(trim_traces, CleandocBuffer)
+    ntrim = sum(name == "write_trim" for calls in trim_traces for name, _ in calls)
+    t = best_of(args.number, lambda: replay(trim_traces))
+    t_cleandoc = best_of(args.number, lambda: replay(trim_traces, CleandocBuffer))
+    print(
+        f"write_trim replay:   {t * 1000:8.2f}ms "
+        f"({ntrim} calls, {t_cleandoc * 1000:.2f}ms using inspect.cleandoc)"
+    )
+
+    def render():
+        for hctx in hctxs:
+            for r in render_all(hctx):
+                r.getvalue()
+
+    t = best_of(args.number, render)
+    print(f"renderers:           {t * 1000:8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,174 @@
-import io
 import contextlib
 import inspect
+import re
+import sys
+import typing
+
+# Indentation strings (and the separators used to join indented lines) are
+# shared between buffers instead of being created each time that the
+# indentation changes
+_indents = [" " * n for n in range(64)]
+_line_seps = [f"\n{indent}" for indent in _indents]
+
+_spaces = re.compile(" *")
+
+
+def _split_margin(s: str) -> typing.Optional[typing.Tuple[str, str, str]]:
+    """
+    Splits the usual input of write_trim (lines after the first that are
+    indented by the same amount, except for empty lines) into the stripped
+    first line, the remaining lines, and the newline and indentation that
+    inspect.cleandoc would remove from the start of each remaining line.
+    Returns None for other input.
+    """
+    # cleandoc and splitlines treat these differently than spaces/newlines
+    if (
+        not s.isascii()
+        or "\t" in s
+        or "\r" in s
+        or "\x0b" in s
+        or "\x0c" in s
+        or "\x1c" in s
+        or "\x1d" in s
+        or "\x1e" in s
+        or "\x1f" in s
+    ):
+        return None
+
+    nl = s.find("\n")
+    if nl == -1:
+        return s.lstrip(), "", "\n"
+
+    # the indentation of the second line must be the smallest, so every
+    # line after it must start with the same indentation, or be empty
+    end = _spaces.match(s, nl + 1).end()
+    if end == len(s) or s[end] == "\n" or end == nl + 1:
+        return None
+
+    margin = end - nl - 1
+    prefix = _line_seps[margin] if margin < len(_line_seps) else s[nl:end]
+
+    # the last line is usually the indentation of the closing quotes, which
+    # is removed like an empty line
+    stop = len(s)
+    last_nl = s.rfind("\n")
+    if stop - last_nl - 1 <= margin and not s[last_nl:].strip(" \n"):
+        stop = last_nl + 1
+
+    nlines = s.count(prefix, nl, stop) + s.count("\n\n", nl, stop)
+    if s.count("\n", nl, stop) != nlines + (s[stop - 1] == "\n"):
+        return None
+
+    # lines that only contain the indentation become empty lines (each
+    # replacement can't include the newline that starts the next line)
+    rest = s[nl:stop]
+    empty_line = f"{prefix}\n"
+    while empty_line in rest:
+        rest = rest.replace(empty_line, "\n\n")
+
+    return s[:nl].lstrip(), rest, prefix
 
 
 class RenderBuffer:
-    def __init__(self) -> None:
-        self._buffer = io.StringIO()
+    """
+    Accumulates generated code. Each line that is written is prefixed with
+    the current indentation, except for empty lines.
+
+    Written text is stored as a list of chunks that are only joined when
+    getvalue is called. If a sink is specified, the chunks are instead
+    passed to it (joined together) each time that flush_chunks of them
+    have accumulated, and when flush is called, so that the entire output
+    never needs to be held in memory.
+    """
+
+    def __init__(
+        self,
+        sink: typing.Optional[typing.Callable[[str], typing.Any]] = None,
+        flush_chunks: int = 1024,
+    ) -> None:
+        self._chunks: typing.List[str] = []
+        self._sink = sink
+        self._flush_at = flush_chunks if sink is not None else sys.maxsize
 
         self._indent = ""
         self._indentlen = 0
+        self._line_sep = "\n"
 
     def getvalue(self) -> str:
-        return self._buffer.getvalue()
+        assert self._sink is None, "output was sent to a sink"
+        return "".join(self._chunks)
+
+    def flush(self):
+        """Passes any text that has been written to the sink"""
+        if self._sink is not None and self._chunks:
+            self._sink("".join(self._chunks))
+            self._chunks.clear()
+
+    def _set_indent(self, indentlen: int):
+        self._indentlen = indentlen
+        if indentlen < len(_indents):
+            self._indent = _indents[indentlen]
+            self._line_sep = _line_seps[indentlen]
+        else:
+            self._indent = " " * indentlen
+            self._line_sep = f"\n{self._indent}"
 
     def rel_indent(self, spaces: int):
-        self._indentlen += spaces
-        self._indent = " " * self._indentlen
+        self._set_indent(self._indentlen + spaces)
 
     @contextlib.contextmanager
     def indent(self, spaces: int = 2):
-        self._indentlen += spaces
-        self._indent = " " * self._indentlen
+        self._set_indent(self._indentlen + spaces)
         try:
             yield
         finally:
-            self._indentlen -= spaces
-            self._indent = " " * self._indentlen
+            self._set_indent(self._indentlen - spaces)
 
     def writeln(self, s: str = ""):
+        chunks = self._chunks
         if not s:
-            self._buffer.write("\n")
+            chunks.append("\n")
         else:
-            for line in s.splitlines(False):
-                if line:
-                    self._buffer.write(f"{self._indent}{line}\n")
-                else:
-                    self._buffer.write("\n")
+            lines = s.splitlines(False)
+            if len(lines) == 1:
+                line = lines[0]
+                chunks.append(f"{self._indent}{line}\n" if line else "\n")
+            else:
+                self._write_lines(lines)
+
+        if len(chunks) >= self._flush_at:
+            self.flush()
 
     def write_trim(self, s: str):
-        for line in inspect.cleandoc(s).splitlines(False):
-            if line:
-                self._buffer.write(f"{self._indent}{line}\n")
-            else:
-                self._buffer.write("\n")
+        """
+        Writes s with the same lines as inspect.cleandoc(s), which removes
+        the indentation of a triple quoted string
+        """
+        parts = _split_margin(s)
+        if parts is None:
+            self._write_lines(inspect.cleandoc(s).splitlines(False))
+        else:
+            # Replacing the removed indentation with the current indentation
+            # indents every line except empty lines, like _write_lines
+            first, rest, prefix = parts
+            text = rest.replace(prefix, self._line_sep)
+            if first:
+                text = f"{self._line_sep}{first}{text}"
+            text = text.strip("\n")
+            if text:
+                self._chunks.append(f"{text}\n")
+        if len(self._chunks) >= self._flush_at:
+            self.flush()
+
+    def _write_lines(self, lines: typing.List[str]):
+        if not lines:
+            return
+
+        indent = self._indent
+        if not indent or "" not in lines:
+            self._chunks.append(f"{indent}{self._line_sep.join(lines)}\n")
+        else:
+            # empty lines are not indented
+            self._chunks.append(
+                "".join([f"{indent}{line}\n" if line else "\n" for line in lines])
+            )
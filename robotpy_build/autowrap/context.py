@@ -9,8 +9,11 @@
 # those data structures directly. While there's some slight overhead added,
 # this should help to keep the logic outside of the templates.
 #
+# Large headers produce a lot of these objects, so they use __slots__ to
+# reduce their memory usage.
+#
 
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 import enum
 import typing
 
@@ -21,10 +24,31 @@ from ..config.autowrap_yml import ReturnValuePolicy
 
 Documentation = typing.Optional[typing.List[str]]
 
+T = typing.TypeVar("T")
+
+
+def _slotted(cls: typing.Type[T]) -> typing.Type[T]:
+    """
+    Recreates a dataclass so that it uses __slots__ for its fields instead
+    of a __dict__ (dataclass(slots=True) requires Python 3.10)
+    """
+    names = tuple(f.name for f in fields(cls))
+    ns = dict(cls.__dict__)
+    for name in names:
+        # defaults are stored by the generated __init__, and would
+        # conflict with the slots
+        ns.pop(name, None)
+    ns.pop("__dict__", None)
+    ns.pop("__weakref__", None)
+    ns["__slots__"] = names
+    return type(cls)(cls.__name__, cls.__bases__, ns)
+
 
 class OverloadTracker:
     """Evaluates to true if overloaded"""
 
+    __slots__ = ("overloads",)
+
     def __init__(self) -> None:
         self.overloads = 0
 
@@ -38,6 +62,7 @@ class OverloadTracker:
         return self.overloads > 1
 
 
+@_slotted
 @dataclass
 class EnumeratorContext:
     """Render data for each enumerator"""
@@ -52,6 +77,7 @@ class EnumeratorContext:
     doc: Documentation
 
 
+@_slotted
 @dataclass
 class EnumContext:
     """Render data for enum"""
@@ -92,6 +118,7 @@ class ParamCategory(enum.Enum):
     TMP = 3
 
 
+@_slotted
 @dataclass
 class ParamContext:
     """Render data for each parameter"""
@@ -140,6 +167,7 @@ class ParamContext:
         return ct
 
 
+@_slotted
 @dataclass
 class GeneratedLambda:
     """
@@ -156,6 +184,7 @@ class GeneratedLambda:
     out_params: typing.List[ParamContext]
 
 
+@_slotted
 @dataclass
 class FunctionContext:
     """Render data for a C++ function or method"""
@@ -262,6 +291,7 @@ class FunctionContext:
     _trampoline_signature: typing.Optional[str] = None
 
 
+@_slotted
 @dataclass
 class PropContext:
     """
@@ -281,6 +311,7 @@ class PropContext:
     bitfield: bool
 
 
+@_slotted
 @dataclass
 class BaseClassData:
     """
@@ -309,6 +340,7 @@ class BaseClassData:
     template_params: str
 
 
+@_slotted
 @dataclass
 class TrampolineData:
     """
@@ -350,6 +382,7 @@ class TrampolineData:
     non_virtual_protected_methods: typing.List[FunctionContext]
 
 
+@_slotted
 @dataclass
 class ClassTemplateData:
     #: N, ..
@@ -364,6 +397,7 @@ class ClassTemplateData:
     instances: typing.List["TemplateInstanceContext"] = field(default_factory=list)
 
 
+@_slotted
 @dataclass
 class ClassContext:
     """
@@ -481,6 +515,7 @@ class ClassContext:
     child_classes: typing.List["ClassContext"] = field(default_factory=list)
 
 
+@_slotted
 @dataclass
 class TemplateInstanceContext:
     #: Name of parent variable in initializer
@@ -505,6 +540,26 @@ class TemplateInstanceContext:
     matched: bool = False
 
 
+@_slotted
+@dataclass
+class ShardContext:
+    """
+    Render data for one of the files that bind the classes of a header.
+    Unless the header is split into multiple shards, there is only one,
+    which is the main file for the header.
+    """
+
+    #: Name of the file and its initialization functions
+    name: str
+
+    #: Top-level classes bound in this file
+    classes: typing.List[ClassContext]
+
+    #: Template instances that are finished in this file
+    template_instances: typing.List[TemplateInstanceContext]
+
+
+@_slotted
 @dataclass
 class HeaderContext:
     """
@@ -521,6 +576,10 @@ class HeaderContext:
     #: Path to the parsed header relative to some root
     rel_fname: str
 
+    #: False if the generated sources must not be combined with the sources
+    #: of other headers in a unity build
+    unity: bool = True
+
     #: True if <pybind11/operators.h> is needed
     need_operators_h: bool = False
 
@@ -532,6 +591,10 @@ class HeaderContext:
     # classes that are not contained in other classes
     classes: typing.List[ClassContext] = field(default_factory=list)
 
+    # classes split by the file that they're bound in, the first is the main
+    # file for the header
+    shards: typing.List[ShardContext] = field(default_factory=list)
+
     # same as classes, but only those that have trampolines
     classes_with_trampolines: typing.List[ClassContext] = field(default_factory=list)
 
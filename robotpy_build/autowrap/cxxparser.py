@@ -7,6 +7,7 @@ import dataclasses
 import pathlib
 import re
 import sys
+import time
 import typing
 from keyword import iskeyword
 
@@ -68,7 +69,9 @@ from ..config.autowrap_yml import (
     ParamData,
     PropAccess,
     ReturnValuePolicy,
+    ShardBy,
 )
+from ..diskcache import DiskCache
 from .generator_data import GeneratorData, OverloadTracker
 from .context import (
     BaseClassData,
@@ -83,9 +86,12 @@ from .context import (
     ParamCategory,
     ParamContext,
     PropContext,
+    ShardContext,
     TemplateInstanceContext,
     TrampolineData,
 )
+from .doccache import DocCache
+from .timing import PhaseTimer, TimedVisitor
 
 
 class HasSubpackage(Protocol):
@@ -331,8 +337,10 @@ class AutowrapVisitor:
         gendata: GeneratorData,
         casters: typing.Dict[str, typing.Dict[str, typing.Any]],
         report_only: bool,
+        doc_cache: typing.Optional[DocCache] = None,
     ) -> None:
         self.hctx = hctx
+        self.doc_cache = doc_cache if doc_cache is not None else DocCache(None, "")
         self.gendata = gendata
         self.user_cfg = gendata.data
         self.report_only = report_only
@@ -967,7 +975,7 @@ class AutowrapVisitor:
             PropContext(
                 py_name=py_name,
                 cpp_name=prop_name,
-                cpp_type=cpp_type,
+                cpp_type=sys.intern(cpp_type),
                 readonly=prop_readonly,
                 doc=doc,
                 array_size=array_size,
@@ -1406,7 +1414,7 @@ class AutowrapVisitor:
         #
         fn_retval: typing.Optional[str] = None
         if fn.return_type:
-            fn_retval = fn.return_type.format()
+            fn_retval = sys.intern(fn.return_type.format())
             self._add_type_caster(fn.return_type)
 
         fctx = FunctionContext(
@@ -1563,10 +1571,12 @@ class AutowrapVisitor:
         x_type_full += "&" * p_reference
         x_type_full += "*" * p_pointer
 
+        # The same types are used by many parameters, so only keep a single
+        # copy of each type string
         return ParamContext(
             arg_name=p_name,
-            cpp_type=cpp_type,
-            full_cpp_type=x_type_full,
+            cpp_type=sys.intern(cpp_type),
+            full_cpp_type=sys.intern(x_type_full),
             py_arg=py_arg,
             default=default,
             # only used by genlambda
@@ -1805,16 +1815,21 @@ class AutowrapVisitor:
         if data.doc is not None:
             doc = data.doc
         elif doxygen:
-            doc = doxygen
-            if param_remap:
-                d = sphinxify.Doc.from_comment(doc)
-                for param in d.params:
-                    new_name = param_remap.get(param.name)
-                    if new_name:
-                        param.name = new_name
-                doc = str(d)
+            cached_doc = self.doc_cache.get(doxygen, param_remap)
+            if cached_doc is not None:
+                doc = cached_doc
             else:
-                doc = sphinxify.process_raw(doc)
+                doc = doxygen
+                if param_remap:
+                    d = sphinxify.Doc.from_comment(doc)
+                    for param in d.params:
+                        new_name = param_remap.get(param.name)
+                        if new_name:
+                            param.name = new_name
+                    doc = str(d)
+                else:
+                    doc = sphinxify.process_raw(doc)
+                self.doc_cache.put(doxygen, param_remap, doc)
 
         if data.doc_append is not None:
             doc += f"\n{append_prefix}" + data.doc_append.replace(
@@ -1972,6 +1987,73 @@ class AutowrapVisitor:
         self.hctx.type_caster_includes = sorted(includes)
 
 
+def _estimate_class_size(cls: ClassContext) -> int:
+    # Roughly proportional to the amount of code generated to bind a class
+    if cls.template is not None:
+        # class templates are bound in their own files
+        return 1
+
+    size = 1 + len(cls.wrapped_public_methods) + len(cls.wrapped_protected_methods)
+    size += len(cls.public_properties) + len(cls.protected_properties)
+    size += len(cls.enums) + len(cls.unnamed_enums)
+    if cls.trampoline is not None:
+        size += len(cls.trampoline.virtual_methods)
+
+    for ccls in cls.child_classes:
+        size += _estimate_class_size(ccls)
+
+    return size
+
+
+def _set_shards(hctx: HeaderContext, nshards: int, shard_by: ShardBy):
+    """
+    Divides the classes of the header into contiguous groups that are bound
+    in separate files, so that classes are still bound in header order
+    """
+    classes = hctx.classes
+    if nshards == 1 or not classes:
+        hctx.shards = [ShardContext(hctx.hname, classes, hctx.template_instances)]
+        return
+
+    if shard_by == ShardBy.SIZE:
+        sizes = [_estimate_class_size(cls) for cls in classes]
+    else:
+        sizes = [1] * len(classes)
+
+    groups: typing.List[typing.List[ClassContext]] = [[] for _ in range(nshards)]
+    total = sum(sizes)
+    start = 0
+    for cls, size in zip(classes, sizes):
+        # each class goes into the shard that its midpoint falls into
+        idx = min((2 * start + size) * nshards // (2 * total), nshards - 1)
+        groups[idx].append(cls)
+        start += size
+
+    main = ShardContext(hctx.hname, groups[0], [])
+    hctx.shards = [main]
+
+    # instances of class templates are finished with their class, the rest
+    # are finished in the main file
+    sharded_tmpls: typing.Set[int] = set()
+    for group in groups[1:]:
+        if group:
+            tmpls = [
+                tmpl_data
+                for cls in group
+                if cls.template is not None
+                for tmpl_data in cls.template.instances
+            ]
+            sharded_tmpls.update(id(tmpl_data) for tmpl_data in tmpls)
+            name = f"{hctx.hname}_shard{len(hctx.shards)}"
+            hctx.shards.append(ShardContext(name, group, tmpls))
+
+    main.template_instances = [
+        tmpl_data
+        for tmpl_data in hctx.template_instances
+        if id(tmpl_data) not in sharded_tmpls
+    ]
+
+
 def parse_header(
     name: str,
     header_path: pathlib.Path,
@@ -1980,9 +2062,14 @@ def parse_header(
     parser_options: ParserOptions,
     casters: typing.Dict[str, typing.Dict[str, typing.Any]],
     report_only: bool,
+    timer: typing.Optional[PhaseTimer] = None,
+    doc_cache: typing.Optional[DiskCache] = None,
 ) -> HeaderContext:
     user_cfg = gendata.data
 
+    if timer is None:
+        timer = PhaseTimer()
+
     # Initialize the header context with user configuration
     hctx = HeaderContext(
         hname=name,
@@ -1990,14 +2077,33 @@ def parse_header(
         extra_includes=user_cfg.extra_includes,
         inline_code=user_cfg.inline_code,
         rel_fname=str(header_path.relative_to(header_root)),
+        unity=user_cfg.unity,
     )
 
     # Parse the header using a custom visitor
-    visitor = AutowrapVisitor(hctx, gendata, casters, report_only)
-    parser = CxxParser(
-        str(header_path), None, visitor, parser_options, encoding=user_cfg.encoding
-    )
+    docs = DocCache(doc_cache, str(header_path.absolute()))
+    visitor = AutowrapVisitor(hctx, gendata, casters, report_only, docs)
+    timed_visitor = TimedVisitor(visitor)
+
+    # .. the parser preprocesses the file when it is created
+    with timer.phase("preprocess"):
+        parser = CxxParser(
+            str(header_path),
+            None,
+            timed_visitor,  # type: ignore
+            parser_options,
+            encoding=user_cfg.encoding,
+        )
+
+    timer.start()
+    start = time.perf_counter()
     parser.parse()
+    timer.add("parse", time.perf_counter() - start - timed_visitor.elapsed)
+    # the visitor runs while parsing, so its memory is included in parse
+    timer.add("visit", timed_visitor.elapsed, measure_peak=False)
+
+    timer.start()
+    visit_start = time.perf_counter()
 
     #
     # Per-header user specified data
@@ -2040,10 +2146,16 @@ def parse_header(
         for param in tmpl_data.params:
             visitor._add_user_type_caster(param)
 
+    _set_shards(hctx, user_cfg.shards, user_cfg.shard_by)
+
     # User typealias additions
     visitor._extract_typealias(user_cfg.typealias, hctx.user_typealias, set())
 
     # Type caster
     visitor._set_type_caster_includes()
 
+    docs.save()
+
+    timer.add("visit", time.perf_counter() - visit_start)
+
     return hctx
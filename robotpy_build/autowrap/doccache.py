@@ -0,0 +1,57 @@
+#
+# Converting doxygen comments to sphinx format can take a large portion of
+# the time spent processing a header, so the results are cached between builds
+#
+
+import json
+import typing
+
+import sphinxify
+
+from ..diskcache import DiskCache
+from ..gencache import compute_key
+
+
+class DocCache:
+    """
+    Remembers the sphinx version of doxygen comments. All of the conversions
+    used by a header are stored as a single cache entry, which only contains
+    the comments that were used the last time the header was processed.
+    """
+
+    def __init__(self, cache: typing.Optional[DiskCache], name: str) -> None:
+        self._cache = cache
+        self._key = compute_key(sphinxify=sphinxify.__version__, name=name)
+        self._old: typing.Dict[str, str] = {}
+        self._used: typing.Dict[str, str] = {}
+
+        if cache is not None:
+            data = cache.get(self._key)
+            if data is not None:
+                try:
+                    self._old = json.loads(data)
+                except ValueError:
+                    pass
+
+    @staticmethod
+    def _entry_key(doxygen: str, param_remap: typing.Dict[str, str]) -> str:
+        if not param_remap:
+            return doxygen
+        return json.dumps([doxygen, sorted(param_remap.items())])
+
+    def get(
+        self, doxygen: str, param_remap: typing.Dict[str, str]
+    ) -> typing.Optional[str]:
+        key = self._entry_key(doxygen, param_remap)
+        doc = self._old.get(key)
+        if doc is not None:
+            self._used[key] = doc
+        return doc
+
+    def put(self, doxygen: str, param_remap: typing.Dict[str, str], doc: str) -> None:
+        self._used[self._entry_key(doxygen, param_remap)] = doc
+
+    def save(self) -> None:
+        """Stores the conversions used since this was created"""
+        if self._cache is not None and self._used != self._old:
+            self._cache.put(self._key, json.dumps(self._used).encode("utf-8"))
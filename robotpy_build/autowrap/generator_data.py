@@ -64,6 +64,13 @@ class GeneratorData:
         self.enums: EnumMissingData = {}
         self.attributes: AttrMissingData = {}
 
+        # id(fn): (fn, signature)
+        self._signatures: Dict[int, Tuple[Function, str]] = {}
+        # id(data): (data, {signature: data merged with overload data})
+        self._overload_data: Dict[int, Tuple[FunctionData, Dict[str, FunctionData]]] = (
+            {}
+        )
+
     def get_class_data(self, name: str) -> ClassData:
         """
         The 'name' is [parent_class::]class_name
@@ -141,16 +148,34 @@ class GeneratorData:
             overload = data.overloads.get(signature)
             missing = overload is None
             if not missing and overload:
-                # merge overload information
-                data = data.dict(exclude_unset=True)
-                del data["overloads"]
-                data.update(overload.dict(exclude_unset=True))
-                data = FunctionData(**data)
+                data = self._get_overload_data(data)[signature]
             report_data.overloads[signature] = is_private or not missing
 
         report_data.tracker.add_overload()
         return data, report_data.tracker
 
+    def _get_overload_data(self, data: FunctionData) -> Dict[str, FunctionData]:
+        """
+        Returns the function data merged with the data for each of its
+        overloads. This is computed once for each function, as many
+        overloads of the same function are usually processed.
+        """
+        entry = self._overload_data.get(id(data))
+        if entry is not None:
+            return entry[1]
+
+        merged: Dict[str, FunctionData] = {}
+        for signature, overload in data.overloads.items():
+            if overload:
+                d = data.dict(exclude_unset=True)
+                del d["overloads"]
+                d.update(overload.dict(exclude_unset=True))
+                merged[signature] = FunctionData(**d)
+
+        # data is kept so that its id isn't reused
+        self._overload_data[id(data)] = (data, merged)
+        return merged
+
     def add_using_decl(
         self, name: str, cls_key: str, cls_data: ClassData, is_private: bool
     ):
@@ -316,6 +341,10 @@ class GeneratorData:
         Only includes the names of parameters and a [const] indicator if needed
         """
 
+        entry = self._signatures.get(id(fn))
+        if entry is not None:
+            return entry[1]
+
         signature = ", ".join(
             f"{p.type.format()}..." if p.param_pack else p.type.format()
             for p in fn.parameters
@@ -334,6 +363,8 @@ class GeneratorData:
         #     else:
         #         signature = "[constexpr]"
 
+        # fn is kept so that its id isn't reused
+        self._signatures[id(fn)] = (fn, signature)
         return signature
 
 
@@ -2,7 +2,9 @@ from .buffer import RenderBuffer
 from .context import HeaderContext
 
 
-def render_class_prologue(r: RenderBuffer, hctx: HeaderContext):
+def render_class_prologue(
+    r: RenderBuffer, hctx: HeaderContext, using_declarations: bool = True
+):
     # fmt: off
     r.writeln(
         "// This file is autogenerated. DO NOT EDIT\n"
@@ -28,10 +30,8 @@ def render_class_prologue(r: RenderBuffer, hctx: HeaderContext):
     if hctx.need_operators_h:
         r.writeln(f"\n#include <pybind11/operators.h>")
 
-    if hctx.using_declarations:
-        r.writeln()
-        for decl in hctx.using_declarations:
-            r.writeln(f"using {decl.format()};")
+    if using_declarations:
+        render_using_declarations(r, hctx)
 
     for cls in hctx.classes_with_trampolines:
         r.writeln()
@@ -39,3 +39,10 @@ def render_class_prologue(r: RenderBuffer, hctx: HeaderContext):
             f"#define RPYGEN_ENABLE_{cls.full_cpp_name_identifier}_PROTECTED_CONSTRUCTORS"
         )
         r.writeln(f"#include <rpygen/{cls.full_cpp_name_identifier}.hpp>")
+
+
+def render_using_declarations(r: RenderBuffer, hctx: HeaderContext):
+    if hctx.using_declarations:
+        r.writeln()
+        for decl in hctx.using_declarations:
+            r.writeln(f"using {decl.format()};")
@@ -23,7 +23,7 @@ def using_signature(cls: ClassContext, fn: FunctionContext) -> str:
     return f"{cls.full_cpp_name_identifier}_{fn.cpp_name}"
 
 
-def render_cls_rpy_include_hpp(ctx: HeaderContext, cls: ClassContext) -> str:
+def render_cls_rpy_include_hpp(r: RenderBuffer, ctx: HeaderContext, cls: ClassContext):
     """
     Pieces that go into an rpy-include file for a class
 
@@ -31,7 +31,6 @@ def render_cls_rpy_include_hpp(ctx: HeaderContext, cls: ClassContext) -> str:
     - Template constructors/method fillers (if applicable)
     """
 
-    r = RenderBuffer()
     r.writeln(
         "// This file is autogenerated. DO NOT EDIT\n"
         "\n"
@@ -58,8 +57,6 @@ def render_cls_rpy_include_hpp(ctx: HeaderContext, cls: ClassContext) -> str:
     if cls.template is not None:
         _render_cls_template_impl(r, ctx, cls, cls.template)
 
-    return r.getvalue()
-
 
 def _render_cls_trampoline(
     r: RenderBuffer, hctx: HeaderContext, cls: ClassContext, trampoline: TrampolineData
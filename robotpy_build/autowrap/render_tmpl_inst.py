@@ -5,9 +5,8 @@ from .render_cls_prologue import render_class_prologue
 
 
 def render_template_inst_cpp(
-    hctx: HeaderContext, tmpl_data: TemplateInstanceContext
-) -> str:
-    r = RenderBuffer()
+    r: RenderBuffer, hctx: HeaderContext, tmpl_data: TemplateInstanceContext
+):
     render_class_prologue(r, hctx)
 
     tmpl_params = ", ".join(tmpl_data.params)
@@ -37,11 +36,9 @@ def render_template_inst_cpp(
     """
     )
     r.writeln()
-    return r.getvalue()
 
 
-def render_template_inst_hpp(hctx: HeaderContext) -> str:
-    r = RenderBuffer()
+def render_template_inst_hpp(r: RenderBuffer, hctx: HeaderContext):
     r.write_trim(
         f"""
         // This file is autogenerated. DO NOT EDIT
@@ -64,4 +61,3 @@ def render_template_inst_hpp(hctx: HeaderContext) -> str:
         )
 
     r.writeln("\n}; // namespace rpygen")
-    return r.getvalue()
@@ -1,19 +1,45 @@
+import typing
+
 from .buffer import RenderBuffer
-from .context import HeaderContext
+from .context import HeaderContext, ShardContext
 
 from . import render_pybind11 as rpybind11
-from .render_cls_prologue import render_class_prologue
+from .render_cls_prologue import render_class_prologue, render_using_declarations
 
 
-def render_wrapped_cpp(hctx: HeaderContext) -> str:
+def render_wrapped_cpp(r: RenderBuffer, hctx: HeaderContext, unity: bool = False):
     """
     This contains the primary binding code generated from parsing a single
     header file. There are also per-class headers generated (templates,
     trampolines), and those are included/used by this.
+
+    If unity is True, the file may be compiled together with the files of
+    other headers, so everything but the initialization functions is put
+    into a namespace instead of the global namespace.
+    """
+    shard = hctx.shards[0]
+    _render_preamble(r, hctx, shard, unity)
+    _render_initializer(r, hctx, shard, True)
+    _render_init_functions(r, shard, hctx.shards[1:], unity)
+
+
+def render_wrapped_shard_cpp(
+    r: RenderBuffer, hctx: HeaderContext, shard: ShardContext, unity: bool = False
+):
     """
-    r = RenderBuffer()
+    Binding code for some of the classes in a header, when the header is
+    split into multiple shards. The initialization functions are called by
+    the initialization functions of the header's main file.
+    """
+    _render_preamble(r, hctx, shard, unity)
+    _render_initializer(r, hctx, shard, False)
+    _render_init_functions(r, shard, [], unity)
+
 
-    render_class_prologue(r, hctx)
+def _render_preamble(
+    r: RenderBuffer, hctx: HeaderContext, shard: ShardContext, unity: bool
+):
+    render_class_prologue(r, hctx, using_declarations=not unity)
 
     if hctx.template_instances:
         r.writeln(f'\n#include "{hctx.hname}_tmpl.hpp"')
@@ -23,6 +49,12 @@ def render_wrapped_cpp(hctx: HeaderContext) -> str:
         for inc in hctx.extra_includes:
             r.writeln(f"#include <{inc}>")
 
+    if unity:
+        # everything after this point can conflict with other files
+        r.writeln("\n#include <type_traits>")
+        r.writeln(f"\nnamespace rpybuild_{shard.name} {{")
+        render_using_declarations(r, hctx)
+
     if hctx.user_typealias:
         r.writeln()
         for typealias in hctx.user_typealias:
@@ -45,17 +77,26 @@ def render_wrapped_cpp(hctx: HeaderContext) -> str:
     #
     # TODO: make type_traits optional by detecting trampoline
 
-    r.writeln("\n#include <type_traits>")
+    if not unity:
+        r.writeln("\n#include <type_traits>")
 
     if hctx.namespaces:
         r.writeln()
         for ns in hctx.namespaces:
             r.writeln(f"using namespace {ns};")
 
-    r.writeln(f"\nstruct rpybuild_{hctx.hname}_initializer {{\n")
+
+def _render_initializer(
+    r: RenderBuffer, hctx: HeaderContext, shard: ShardContext, is_main: bool
+):
+    # Global enums, functions, templates that aren't associated with a class
+    # in this header, and the user's inline code are only in the main file
+    classes = shard.classes
+
+    r.writeln(f"\nstruct rpybuild_{shard.name}_initializer {{\n")
 
     with r.indent():
-        for cls in hctx.classes:
+        for cls in classes:
             if not cls.template:
                 rpybind11.cls_user_using(r, cls)
                 rpybind11.cls_consts(r, cls)
@@ -65,17 +106,20 @@ def render_wrapped_cpp(hctx: HeaderContext) -> str:
             for vname in hctx.subpackages.values():
                 r.writeln(f"py::module {vname};")
 
-        # enums
-        for index, enum in enumerate(hctx.enums, start=1):
-            rpybind11.enum_decl(r, enum, f"enum{index}")
+        if is_main:
+            # enums
+            for index, enum in enumerate(hctx.enums, start=1):
+                rpybind11.enum_decl(r, enum, f"enum{index}")
 
-        # template decls
-        for tmpl_data in hctx.template_instances:
-            if not tmpl_data.matched:
-                r.writeln(f"rpygen::{tmpl_data.binder_typename} {tmpl_data.var_name};")
+            # template decls
+            for tmpl_data in hctx.template_instances:
+                if not tmpl_data.matched:
+                    r.writeln(
+                        f"rpygen::{tmpl_data.binder_typename} {tmpl_data.var_name};"
+                    )
 
         # class decls
-        for cls in hctx.classes:
+        for cls in classes:
             if cls.template is None:
                 r.writeln()
                 rpybind11.cls_decl(r, cls)
@@ -87,24 +131,25 @@ def render_wrapped_cpp(hctx: HeaderContext) -> str:
                     )
 
         r.writeln("\npy::module &m;\n")
-        r.writeln(f"rpybuild_{hctx.hname}_initializer(py::module &m) :")
+        r.writeln(f"rpybuild_{shard.name}_initializer(py::module &m) :")
 
         with r.indent():
             for pkg, vname in hctx.subpackages.items():
                 r.writeln(f'{vname}(m.def_submodule("{pkg}")),')
 
-            for index, enum in enumerate(hctx.enums, start=1):
-                r.writeln(
-                    f"enum{index}({rpybind11.enum_init_args(enum.scope_var, enum)}),"
-                )
-
-            for tmpl_data in hctx.template_instances:
-                if not tmpl_data.matched:
+            if is_main:
+                for index, enum in enumerate(hctx.enums, start=1):
                     r.writeln(
-                        f'{tmpl_data.var_name}({tmpl_data.scope_var}, "{tmpl_data.py_name}"),'
+                        f"enum{index}({rpybind11.enum_init_args(enum.scope_var, enum)}),"
                     )
 
-            for cls in hctx.classes:
+                for tmpl_data in hctx.template_instances:
+                    if not tmpl_data.matched:
+                        r.writeln(
+                            f'{tmpl_data.var_name}({tmpl_data.scope_var}, "{tmpl_data.py_name}"),'
+                        )
+
+            for cls in classes:
                 if not cls.template:
                     rpybind11.cls_init(r, cls, f'"{cls.py_name}"')
                 else:
@@ -115,18 +160,19 @@ def render_wrapped_cpp(hctx: HeaderContext) -> str:
 
             r.writeln("m(m)")
 
-        if hctx.enums or hctx.classes:
+        if (is_main and hctx.enums) or classes:
             r.writeln("{")
             with r.indent():
                 # enums can go in the initializer because they cant have dependencies,
                 # and then we dont need to figure out class dependencies for enum arguments
 
-                for index, enum in enumerate(hctx.enums, start=1):
-                    r.writeln(f"enum{index}")
-                    with r.indent():
-                        rpybind11.enum_def(r, enum.scope_var, enum)
+                if is_main:
+                    for index, enum in enumerate(hctx.enums, start=1):
+                        r.writeln(f"enum{index}")
+                        with r.indent():
+                            rpybind11.enum_def(r, enum.scope_var, enum)
 
-                for cls in hctx.classes:
+                for cls in classes:
                     rpybind11.cls_def_enum(r, cls, cls.var_name)
                     for ccls in cls.child_classes:
                         rpybind11.cls_def_enum(r, ccls, ccls.var_name)
@@ -139,7 +185,7 @@ def render_wrapped_cpp(hctx: HeaderContext) -> str:
         with r.indent():
 
             # Templates
-            for tdata in hctx.template_instances:
+            for tdata in shard.template_instances:
                 r.writeln(f"\n{tdata.var_name}.finish(")
                 with r.indent():
                     if tdata.doc_set:
@@ -154,7 +200,7 @@ def render_wrapped_cpp(hctx: HeaderContext) -> str:
                 r.writeln(");")
 
             # Class methods
-            for cls in hctx.classes:
+            for cls in classes:
                 if not cls.template:
                     r.writeln("{")
                     with r.indent():
@@ -162,35 +208,64 @@ def render_wrapped_cpp(hctx: HeaderContext) -> str:
                         rpybind11.cls_def(r, cls, cls.var_name)
                     r.writeln("}")
 
-            # Global methods
-            if hctx.functions:
-                r.writeln()
-                for fn in hctx.functions:
-                    if not fn.ignore_py:
-                        r.writeln(fn.scope_var)
-                        with r.indent(1):
-                            rpybind11.genmethod(r, None, fn, None)
-                        r.writeln(";")
-
-            if hctx.inline_code:
-                r.writeln()
-                r.write_trim(hctx.inline_code)
+            if is_main:
+                # Global methods
+                if hctx.functions:
+                    r.writeln()
+                    for fn in hctx.functions:
+                        if not fn.ignore_py:
+                            r.writeln(fn.scope_var)
+                            with r.indent(1):
+                                rpybind11.genmethod(r, None, fn, None)
+                            r.writeln(";")
+
+                if hctx.inline_code:
+                    r.writeln()
+                    r.write_trim(hctx.inline_code)
 
         r.writeln("}")
 
+    r.writeln(f"}}; // struct rpybuild_{shard.name}_initializer")
+
+
+def _render_init_functions(
+    r: RenderBuffer,
+    shard: ShardContext,
+    shards: typing.List[ShardContext],
+    unity: bool,
+):
+    name = shard.name
+    cls_decl = f"\nstatic std::unique_ptr<rpybuild_{name}_initializer> cls;"
+
+    scope = ""
+    if unity:
+        r.writeln(cls_decl)
+        r.writeln(f"\n}} // namespace rpybuild_{name}")
+        scope = f"rpybuild_{name}::"
+
+    if shards:
+        # The other shards are initialized after this one, so that classes
+        # are initialized in the same order as if there weren't any shards
+        r.writeln()
+        for s in shards:
+            r.writeln(f"void begin_init_{s.name}(py::module &m);")
+            r.writeln(f"void finish_init_{s.name}();")
+
+    if not unity:
+        r.writeln(cls_decl)
+
+    begin_shards = "".join(f"  begin_init_{s.name}(m);\n" for s in shards)
+    finish_shards = "".join(f"  finish_init_{s.name}();\n" for s in shards)
     r.writeln(
-        f"}}; // struct rpybuild_{hctx.hname}_initializer\n"
         "\n"
-        f"static std::unique_ptr<rpybuild_{hctx.hname}_initializer> cls;\n"
-        "\n"
-        f"void begin_init_{hctx.hname}(py::module &m) {{\n"
-        f"  cls = std::make_unique<rpybuild_{hctx.hname}_initializer>(m);\n"
+        f"void begin_init_{name}(py::module &m) {{\n"
+        f"  {scope}cls = std::make_unique<{scope}rpybuild_{name}_initializer>(m);\n"
+        f"{begin_shards}"
         "}\n"
         "\n"
-        f"void finish_init_{hctx.hname}() {{\n"
-        "  cls->finish();\n"
-        "  cls.reset();\n"
+        f"void finish_init_{name}() {{\n"
+        f"  {scope}cls->finish();\n"
+        f"  {scope}cls.reset();\n"
+        f"{finish_shards}"
         "}\n"
     )
-
-    return r.getvalue()
@@ -0,0 +1,124 @@
+#
+# Records how long each phase of generating a header takes, so that it is
+# possible to tell which headers (and which parts of the generator) are
+# responsible for a slow build
+#
+
+import contextlib
+import sys
+import time
+import typing
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
+
+#: Phases in the order that they happen
+PHASES = ("load", "preprocess", "parse", "visit", "render", "write")
+
+
+def reset_peak_rss() -> bool:
+    """
+    Resets the peak resident memory of this process to its current resident
+    memory. Only supported on Linux, returns False if it isn't supported.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fp:
+            fp.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def get_peak_rss() -> typing.Optional[float]:
+    """
+    Peak resident memory of this process in MB (since reset_peak_rss was
+    last called), if it can be determined
+    """
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+
+    if resource is None:
+        return None
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return maxrss / (1024 * 1024)
+    return maxrss / 1024
+
+
+class PhaseTimer:
+    """
+    Accumulates the wall time spent in each phase, the peak memory usage of
+    the process during each phase, and how much the phase increased it over
+    the memory in use at the start of the phase. Memory is only recorded
+    where the peak can be reset at the start of each phase (Linux),
+    otherwise it would be the peak of every phase so far.
+    """
+
+    def __init__(self) -> None:
+        #: phase name: {"time": seconds, "peak_rss": MB, "peak_rss_increase": MB}
+        self.phases: typing.Dict[str, typing.Dict[str, float]] = {}
+        self._measure_peak = reset_peak_rss()
+        self._start_rss = 0.0
+
+    def start(self) -> None:
+        """Marks the start of a phase that is recorded by add"""
+        if self._measure_peak and reset_peak_rss():
+            self._start_rss = get_peak_rss() or 0.0
+
+    def add(self, name: str, elapsed: float, measure_peak: bool = True) -> None:
+        entry = self.phases.setdefault(name, {"time": 0.0})
+        entry["time"] += elapsed
+
+        rss = get_peak_rss() if measure_peak and self._measure_peak else None
+        if rss is not None:
+            increase = max(rss - self._start_rss, 0.0)
+            entry["peak_rss"] = max(entry.get("peak_rss", 0.0), rss)
+            entry["peak_rss_increase"] = max(
+                entry.get("peak_rss_increase", 0.0), increase
+            )
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> typing.Iterator[None]:
+        self.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def total(self) -> float:
+        return sum(p["time"] for p in self.phases.values())
+
+
+class TimedVisitor:
+    """
+    Wraps a cxxheaderparser visitor and records the time spent in its
+    callbacks, so that it can be separated from the time spent parsing
+    """
+
+    def __init__(self, visitor: typing.Any) -> None:
+        self._visitor = visitor
+        #: Total time spent in the visitor
+        self.elapsed = 0.0
+
+    def __getattr__(self, name: str) -> typing.Any:
+        fn = getattr(self._visitor, name)
+        if not name.startswith("on_"):
+            return fn
+
+        def _timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.elapsed += time.perf_counter() - start
+
+        return _timed
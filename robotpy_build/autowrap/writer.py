@@ -1,18 +1,162 @@
+import contextlib
+import glob
 import json
 import os
-from os.path import join
+from os.path import abspath, dirname, join, relpath
 import pprint
 import typing
 
+from .buffer import RenderBuffer
 from .context import HeaderContext
-from .render_wrapped import render_wrapped_cpp
+from .render_wrapped import render_wrapped_cpp, render_wrapped_shard_cpp
 from .render_cls_rpy_include import render_cls_rpy_include_hpp
 from .render_tmpl_inst import render_template_inst_cpp, render_template_inst_hpp
+from .timing import PhaseTimer
 
 _emit_j2_debug = os.getenv("RPYBUILD_J2_DEBUG") == "1"
 
+# Amount of the existing file that is read at a time when it is copied
+_COPY_SIZE = 1024 * 1024
+
+
+class _FileUpdater:
+    """
+    Replaces the contents of a file with text that is written to it in
+    pieces. The new text is compared with the existing contents of the file
+    as it is written, and the file is only replaced if the text differs.
+    Nothing is written to disk until the first difference is found.
+    """
+
+    def __init__(self, fname: str, encoding: str) -> None:
+        self.fname = fname
+        self.encoding = encoding
+        self._tmpname = f"{fname}.{os.getpid()}.tmp"
+        self._tmp: typing.Optional[typing.TextIO] = None
+        #: number of characters known to be the same as the existing file
+        self._same = 0
+
+        self._old: typing.Optional[typing.TextIO]
+        try:
+            self._old = open(fname, encoding=encoding)
+        except OSError:
+            self._old = None
+
+    def write(self, s: str):
+        if self._tmp is None:
+            if self._old is not None:
+                try:
+                    if self._old.read(len(s)) == s:
+                        self._same += len(s)
+                        return
+                except ValueError:
+                    pass
+
+            self._open_tmp()
+            assert self._tmp is not None
+
+        self._tmp.write(s)
+
+    def _open_tmp(self):
+        self._tmp = open(self._tmpname, "w", encoding=self.encoding)
+
+        # copy the part of the existing file that was the same
+        if self._same:
+            assert self._old is not None
+            self._old.seek(0)
+            remaining = self._same
+            while remaining:
+                data = self._old.read(min(remaining, _COPY_SIZE))
+                self._tmp.write(data)
+                remaining -= len(data)
+
+    def close(self) -> bool:
+        """Finishes writing the file. Returns True if the file changed."""
+        try:
+            if self._tmp is None:
+                # the file is only the same if there's nothing left in it
+                if self._old is not None:
+                    try:
+                        if self._old.read(1) == "":
+                            return False
+                    except ValueError:
+                        pass
+
+                self._open_tmp()
+                assert self._tmp is not None
+
+            self._tmp.close()
+            if self._old is not None:
+                self._old.close()
+                self._old = None
+            os.replace(self._tmpname, self.fname)
+            self._tmp = None
+            return True
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Leaves the existing file untouched"""
+        if self._old is not None:
+            self._old.close()
+            self._old = None
+        if self._tmp is not None:
+            self._tmp.close()
+            self._tmp = None
+            try:
+                os.unlink(self._tmpname)
+            except OSError:
+                pass
+
 
 class WrapperWriter:
+    def __init__(self) -> None:
+        #: Number of files that write_file was asked to write
+        self.files_written = 0
+        #: Number of files whose contents actually changed
+        self.files_changed = 0
+
+    def write_file(self, fname: str, content: str, encoding: str = "utf-8") -> bool:
+        """
+        Writes content to fname, but only if it differs from what is already
+        in the file so that the file's mtime doesn't change unnecessarily.
+        The file is replaced atomically. Returns True if the file changed.
+        """
+        self.files_written += 1
+
+        updater = _FileUpdater(fname, encoding)
+        try:
+            updater.write(content)
+        except BaseException:
+            updater.abort()
+            raise
+
+        if not updater.close():
+            return False
+
+        self.files_changed += 1
+        return True
+
+    @contextlib.contextmanager
+    def render_file(
+        self, fname: str, encoding: str = "utf-8"
+    ) -> typing.Iterator[RenderBuffer]:
+        """
+        Returns a RenderBuffer that writes to fname as text is rendered into
+        it, with the same behavior as write_file
+        """
+        self.files_written += 1
+
+        updater = _FileUpdater(fname, encoding)
+        try:
+            r = RenderBuffer(updater.write)
+            yield r
+            r.flush()
+        except BaseException:
+            updater.abort()
+            raise
+
+        if updater.close():
+            self.files_changed += 1
 
     def write_files(
         self,
@@ -21,27 +165,55 @@ class WrapperWriter:
         cxx_gen_dir: str,
         hppoutdir: str,
         classdeps_json_fname: str,
+        outputs: typing.Optional[typing.List[str]] = None,
+        timer: typing.Optional[PhaseTimer] = None,
+        unity: bool = False,
     ) -> typing.List[str]:
-        """Generates all files needed for a single processed header"""
+        """
+        Generates all files needed for a single processed header. Returns
+        the generated sources that need to be compiled. If outputs is
+        specified, every file that is written is appended to it.
 
-        generated_sources: typing.List[str] = []
+        If unity is True, the sources in cxx_gen_dir are generated so that
+        they can be combined by write_unity_files.
+        """
 
-        # Jinja requires input as a dictionary
-        data = hctx.__dict__
+        if outputs is None:
+            outputs = []
+        if timer is None:
+            timer = PhaseTimer()
+
+        def _write(fname: str, content: str):
+            with timer.phase("write"):
+                outputs.append(fname)
+                self.write_file(fname, content)
+
+        def _render(fname: str, render: typing.Callable[..., None], *args):
+            # rendering and writing happen together, so the time spent
+            # writing is included in the render time
+            with timer.phase("render"):
+                outputs.append(fname)
+                with self.render_file(fname) as r:
+                    render(r, *args)
+
+        generated_sources: typing.List[str] = []
 
         if _emit_j2_debug:
-            with open(join(cxx_gen_dir, f"{name}.txt"), "w") as fp:
-                fp.write(pprint.pformat(hctx))
+            _write(join(cxx_gen_dir, f"{name}.txt"), pprint.pformat(hctx))
 
         # Write the cpp file first
         fname = join(cxx_gen_dir, f"{name}.cpp")
         generated_sources.append(fname)
-        with open(fname, "w", encoding="utf-8") as fp:
-            fp.write(render_wrapped_cpp(hctx))
+        _render(fname, render_wrapped_cpp, hctx, unity)
+
+        # Classes in other shards are bound in separate files
+        for shard in hctx.shards[1:]:
+            fname = join(cxx_gen_dir, f"{shard.name}.cpp")
+            generated_sources.append(fname)
+            _render(fname, render_wrapped_shard_cpp, hctx, shard, unity)
 
         # Then the json
-        with open(classdeps_json_fname, "w", encoding="utf-8") as fp:
-            json.dump(hctx.class_hierarchy, fp)
+        _write(classdeps_json_fname, json.dumps(hctx.class_hierarchy))
 
         # Generate an rpy-include file for each class that has either a trampoline
         # or a template class
@@ -52,23 +224,97 @@ class WrapperWriter:
             fname = join(
                 hppoutdir, f"{cls.namespace.replace(':', '_')}__{cls.cpp_name}.hpp"
             )
-            with open(fname, "w", encoding="utf-8") as fp:
-                fp.write(render_cls_rpy_include_hpp(hctx, cls))
+            _render(fname, render_cls_rpy_include_hpp, hctx, cls)
 
         # Each class template is instantiated in a separate cpp file to lessen
         # compiler memory requirements when compiling obnoxious templates
         if hctx.template_instances:
             # Single header output that holds all the struct outlines
             fname = join(cxx_gen_dir, f"{name}_tmpl.hpp")
-            with open(fname, "w", encoding="utf-8") as fp:
-                fp.write(render_template_inst_hpp(hctx))
+            _render(fname, render_template_inst_hpp, hctx)
 
             # Each cpp file has a single class template instance
             for i, tmpl_data in enumerate(hctx.template_instances):
-                data["tmpl_data"] = tmpl_data
                 fname = join(hppoutdir, f"{name}_tmpl{i+1}.cpp")
                 generated_sources.append(fname)
-                with open(fname, "w", encoding="utf-8") as fp:
-                    fp.write(render_template_inst_cpp(hctx, tmpl_data))
+                _render(fname, render_template_inst_cpp, hctx, tmpl_data)
 
         return generated_sources
+
+    def write_unity_files(
+        self,
+        outdir: str,
+        sources: typing.List[str],
+        max_size: int,
+        separate: typing.Collection[str] = (),
+    ) -> typing.List[str]:
+        """
+        Combines small generated sources in outdir into files that include
+        them, so that fewer files need to be compiled. Each source is added
+        to the first combined file that it fits in without making the file
+        larger than max_size. Sources in other directories (template
+        instances, which are separate to limit compiler memory usage) and
+        sources in separate are not combined.
+
+        The sources that are combined must have been generated with
+        unity=True. Returns the sources that need to be compiled instead of
+        the specified sources.
+        """
+        abs_outdir = abspath(outdir)
+        result: typing.List[str] = []
+
+        # [size, has trampolines, sources]
+        batches: typing.List[typing.List[typing.Any]] = []
+
+        for src in sources:
+            size = os.path.getsize(src)
+            if (
+                abspath(dirname(src)) != abs_outdir
+                or size > max_size
+                or src in separate
+            ):
+                result.append(src)
+                continue
+
+            # Trampolines are configured by the macros that are defined when
+            # they are first included, so only one of the combined sources
+            # can use trampolines
+            with open(src, encoding="utf-8") as fp:
+                trampolines = "\n#include <rpygen/" in fp.read()
+
+            for batch in batches:
+                if batch[0] + size <= max_size and not (trampolines and batch[1]):
+                    break
+            else:
+                batch = [0, False, []]
+                batches.append(batch)
+
+            batch[0] += size
+            batch[1] = batch[1] or trampolines
+            batch[2].append(src)
+
+        unity_files = set()
+        for _, _, batch_sources in batches:
+            if len(batch_sources) == 1:
+                result.append(batch_sources[0])
+                continue
+
+            fname = join(outdir, f"rpygen_unity{len(unity_files) + 1}.cpp")
+            unity_files.add(fname)
+            result.append(fname)
+
+            content = [
+                "// This file is autogenerated. DO NOT EDIT\n",
+                "// Generated sources that are compiled together\n",
+                "\n",
+            ]
+            for src in batch_sources:
+                content.append(f'#include "{relpath(src, outdir)}"\n')
+            self.write_file(fname, "".join(content))
+
+        # remove files from previous builds that are no longer used
+        for fname in glob.glob(join(glob.escape(outdir), "rpygen_unity*.cpp")):
+            if fname not in unity_files:
+                os.unlink(fname)
+
+        return result
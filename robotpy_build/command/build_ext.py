@@ -2,16 +2,30 @@
 # Portions copied from pybind11's setup_helpers.py
 #
 
+import concurrent.futures
 import os
-from os.path import join
+from os.path import abspath, join, splitext
+import re
 from setuptools.command.build_ext import build_ext
 import platform
 import setuptools
 import sys
 import sysconfig
 import tempfile
-
+import threading
+import typing
+
+from .compile_scheduler import (
+    CompileHistory,
+    CompileScheduler,
+    JobServer,
+    get_compile_jobs,
+    get_memory_budget,
+    spawn_measured,
+)
 from .util import get_install_root
+from ..diskcache import get_cache
+from ..gencache import compute_key, identify_executables
 from ..platforms import get_platform
 
 # TODO: only works for GCC
@@ -22,12 +36,34 @@ MACOS = sys.platform.startswith("darwin")
 STD_TMPL = "/std:c++{}" if WIN else "-std=c++{}"
 
 
-# As of Python 3.6, CCompiler has a `has_flag` method.
-# cf http://bugs.python.org/issue26689
-def has_flag(compiler, flagname):
-    """Return a boolean indicating whether a flag name is supported on
-    the specified compiler.
+#: Results of has_flag, keyed by _probe_key
+_probe_results: typing.Dict[str, bool] = {}
+
+
+def _probe_key(compiler, flagname: str) -> str:
+    """
+    Identifies a flag probe. The compiler executables are identified by
+    their size and mtime, so that the results are invalidated when the
+    compiler is upgraded.
     """
+    if compiler.compiler_type == "msvc":
+        # the path of cl.exe is found when the compiler is initialized
+        if not getattr(compiler, "initialized", True):
+            compiler.initialize()
+        cmd = [compiler.cc]
+    else:
+        cmd = compiler.compiler_so
+
+    return compute_key(
+        probe="has_flag",
+        compiler_type=compiler.compiler_type,
+        cmd=cmd,
+        executables=identify_executables(cmd),
+        flag=flagname,
+    )
+
+
+def _run_probe(compiler, flagname: str) -> bool:
     with tempfile.TemporaryDirectory() as tmpdir:
         fname = join(tmpdir, "test.cpp")
         with open(fname, "w") as fp:
@@ -39,18 +75,221 @@ def has_flag(compiler, flagname):
     return True
 
 
+def probe_flags(compiler, flagnames: typing.Iterable[str]) -> typing.Dict[str, bool]:
+    """
+    Determines whether each flag is supported by the compiler. Results are
+    stored in the 'probes' persistent cache, and flags that aren't in the
+    cache are probed concurrently.
+    """
+    keys = {flagname: _probe_key(compiler, flagname) for flagname in flagnames}
+    results: typing.Dict[str, bool] = {}
+    missing = []
+
+    cache = get_cache("probes")
+    for flagname, key in keys.items():
+        result = _probe_results.get(key)
+        if result is None and cache is not None:
+            data = cache.get(key)
+            if data is not None:
+                result = data == b"1"
+        if result is None:
+            missing.append(flagname)
+        else:
+            results[flagname] = _probe_results[key] = result
+
+    if missing:
+        with concurrent.futures.ThreadPoolExecutor(len(missing)) as executor:
+            probed = executor.map(lambda f: _run_probe(compiler, f), missing)
+            for flagname, result in zip(missing, probed):
+                key = keys[flagname]
+                results[flagname] = _probe_results[key] = result
+                if cache is not None:
+                    cache.put(key, b"1" if result else b"0")
+
+        if cache is not None:
+            cache.prune()
+
+    return results
+
+
+# As of Python 3.6, CCompiler has a `has_flag` method.
+# cf http://bugs.python.org/issue26689
+def has_flag(compiler, flagname):
+    """Return a boolean indicating whether a flag name is supported on
+    the specified compiler.
+    """
+    return probe_flags(compiler, [flagname])[flagname]
+
+
 def cxx_std(compiler) -> int:
     """Return the -std=c++[11/14/17/20] compiler flag.
     The newer version is prefered over c++11 (when it is available).
     """
 
-    for level in (20, 17, 17, 11):
+    # only the first supported level matters, so older levels are only
+    # checked if newer ones aren't supported
+    for level in (20, 17, 11):
         if has_flag(compiler, STD_TMPL.format(level)):
             return level
 
     raise RuntimeError("Unsupported compiler -- at least C++11 support is needed!")
 
 
+def _read_make_deps(fname: str) -> typing.Optional[typing.List[str]]:
+    """Returns the dependencies listed in a depfile written by gcc/clang"""
+    try:
+        with open(fname) as fp:
+            contents = fp.read()
+    except OSError:
+        return None
+
+    _, sep, deps = contents.replace("\\\n", " ").partition(": ")
+    if not sep:
+        return None
+
+    return [d.replace("\\ ", " ") for d in re.split(r"(?<!\\)\s+", deps.strip()) if d]
+
+
+def _object_is_current(obj: str, depfile: str, argsfile: str, key: str) -> bool:
+    try:
+        with open(argsfile) as fp:
+            if fp.read() != key:
+                return False
+
+        mtime = os.stat(obj).st_mtime_ns
+        deps = _read_make_deps(depfile)
+        if not deps:
+            return False
+
+        return all(os.stat(dep).st_mtime_ns <= mtime for dep in deps)
+    except OSError:
+        return False
+
+
+def skip_current_objects(compiler) -> None:
+    """
+    Only recompile an object if its source, any header that it includes, or
+    the compiler arguments have changed since it was compiled. The compiler
+    writes the headers used by each object to a depfile next to the object.
+
+    System headers aren't written to the depfile, so objects aren't
+    recompiled when they change; this is only used when requested.
+    """
+    _compile = compiler._compile
+
+    # the compiler may be upgraded without its path changing
+    compiler_so_cxx = getattr(compiler, "compiler_so_cxx", None)
+    executables = identify_executables(compiler.compiler_so)
+    if compiler_so_cxx:
+        executables.update(identify_executables(compiler_so_cxx))
+
+    def _incremental_compile(obj, src, ext, cc_args, extra_postargs, pp_opts):
+        base = splitext(obj)[0]
+        depfile = base + ".d"
+        argsfile = base + ".args"
+        key = compute_key(
+            compiler=compiler.compiler_so,
+            compiler_cxx=compiler_so_cxx,
+            executables=executables,
+            src=src,
+            cc_args=cc_args,
+            extra_postargs=extra_postargs,
+            pp_opts=pp_opts,
+        )
+        if _object_is_current(obj, depfile, argsfile, key):
+            return
+
+        extra_postargs = extra_postargs + ["-MMD", "-MF", depfile]
+        _compile(obj, src, ext, cc_args, extra_postargs, pp_opts)
+
+        with open(argsfile, "w") as fp:
+            fp.write(key)
+
+    compiler._compile = _incremental_compile
+
+
+def include_pch(compiler, pch_headers: typing.Dict[str, str]) -> None:
+    """
+    Includes a header before anything else in each source listed in
+    pch_headers (which maps absolute source paths to headers). gcc and clang
+    use the precompiled version of the header (HEADER.gch) if it exists and
+    was compiled with the same options.
+    """
+    _compile = compiler._compile
+
+    def _pch_compile(obj, src, ext, cc_args, extra_postargs, pp_opts):
+        header = pch_headers.get(abspath(src))
+        if header is not None:
+            extra_postargs = extra_postargs + ["-Winvalid-pch", "-include", header]
+        _compile(obj, src, ext, cc_args, extra_postargs, pp_opts)
+
+    compiler._compile = _pch_compile
+
+
+def parallel_compile(compiler, scheduler: CompileScheduler) -> None:
+    """
+    Replaces compiler.compile with a version that uses the scheduler to
+    compile the sources. Each source is still compiled by compiler._compile,
+    and the peak memory used by the compiler is measured if possible.
+    """
+    spawn = compiler.spawn
+    measured = threading.local()
+
+    def _spawn(cmd, **kwargs):
+        if not getattr(measured, "active", False) or kwargs:
+            spawn(cmd, **kwargs)
+            return
+
+        if hasattr(os, "wait4"):
+            peak_rss = spawn_measured(cmd, compiler.dry_run)
+        else:
+            spawn(cmd)
+            peak_rss = 0
+        measured.peak_rss = max(measured.peak_rss or 0, peak_rss)
+
+    compiler.spawn = _spawn
+
+    def _compile(
+        sources,
+        output_dir=None,
+        macros=None,
+        include_dirs=None,
+        debug=0,
+        extra_preargs=None,
+        extra_postargs=None,
+        depends=None,
+    ):
+        # same as distutils.ccompiler.CCompiler.compile, except for the loop
+        macros, objects, extra_postargs, pp_opts, build = compiler._setup_compile(
+            output_dir, macros, include_dirs, sources, depends, extra_postargs
+        )
+        cc_args = compiler._get_cc_args(pp_opts, debug, extra_preargs)
+
+        def _job(obj: str, src: str, ext: str):
+            def _compile_one() -> typing.Optional[int]:
+                # stays None if the object is up to date
+                measured.active = True
+                measured.peak_rss = None
+                try:
+                    compiler._compile(obj, src, ext, cc_args, extra_postargs, pp_opts)
+                    return measured.peak_rss
+                except setuptools.distutils.errors.CompileError as e:
+                    # the output of other compilers may be mixed in with the
+                    # error, so say which source failed
+                    raise setuptools.distutils.errors.CompileError(
+                        f"{src}: {e}"
+                    ) from None
+                finally:
+                    measured.active = False
+
+            return _compile_one
+
+        scheduler.run([(src, _job(obj, src, ext)) for obj, (src, ext) in build.items()])
+        return objects
+
+    compiler.compile = _compile
+
+
 def get_opts(typ, std):
     c_opts = {"msvc": ["/EHsc", "/bigobj"], "unix": []}
     l_opts = {"msvc": [], "unix": []}
@@ -85,8 +324,21 @@ def get_opts(typ, std):
 class BuildExt(build_ext):
     """A custom build extension for adding compiler-specific options."""
 
+    #: Precompiled header to include in each source, if enabled
+    _pch_headers: typing.Optional[typing.Dict[str, str]] = None
+
     def build_extensions(self):
         ct = self.compiler.compiler_type
+
+        # the flags that are checked below are independent, so check them
+        # all at once (older C++ standards are only checked if needed)
+        probes = [STD_TMPL.format(20)]
+        if ct == "unix":
+            probes.append("-fvisibility=hidden")
+        elif ct == "msvc":
+            probes += ["/Zc:preprocessor", "/utf-8"]
+        probe_flags(self.compiler, probes)
+
         std = cxx_std(self.compiler)
         opts, link_opts = get_opts(ct, std)
 
@@ -115,6 +367,16 @@ class BuildExt(build_ext):
                 # compiler_cxx is only used for linking, so we don't mess with it
                 # .. distutils is so weird
                 # self.compiler.compiler_cxx.insert(0, cc_launcher)
+
+            if not self.force and os.environ.get("RPYBUILD_INCREMENTAL") == "1":
+                skip_current_objects(self.compiler)
+
+            # multiple architectures can't share a precompiled header
+            if os.environ.get("RPYBUILD_PCH") == "1" and (
+                self.compiler.compiler_so.count("-arch") <= 1
+            ):
+                self._pch_headers = {}
+                include_pch(self.compiler, self._pch_headers)
         elif ct == "msvc":
             opts.append(STD_TMPL.format(std))
             opts.append("/Zc:__cplusplus")
@@ -133,6 +395,28 @@ class BuildExt(build_ext):
 
                 self.compiler._rpy_spawn = self.compiler.spawn
                 self.compiler.spawn = _spawn
+
+        jobserver: typing.Optional[JobServer] = None
+        if ct != "msvc":
+            jobs = get_compile_jobs(self.parallel)
+            try:
+                jobserver = JobServer.from_environ()
+            except (OSError, ValueError):
+                # make expects programs that can't use its jobserver to
+                # only run a single job
+                print("WARNING: make jobserver is not available, compiling serially")
+                jobs = 1
+                jobserver = None
+            history = CompileHistory(
+                join(self.build_temp, "rpybuild_compile_history.json")
+            )
+            scheduler = CompileScheduler(jobs, jobserver, get_memory_budget(), history)
+            parallel_compile(self.compiler, scheduler)
+
+            # Extensions are built one at a time, and the sources of each
+            # one are compiled in parallel instead
+            self.parallel = None
+
         for ext in self.extensions:
             if debug:
                 ext.define_macros.append(
@@ -143,7 +427,11 @@ class BuildExt(build_ext):
 
         # self._gather_global_includes()
 
-        build_ext.build_extensions(self)
+        try:
+            build_ext.build_extensions(self)
+        finally:
+            if jobserver is not None:
+                jobserver.close()
 
         # Fix Libraries on macOS
         # Uses @loader_path, is compatible with macOS >= 10.4
@@ -165,6 +453,58 @@ class BuildExt(build_ext):
                 # Used in build_pyi
                 ext.rpybuild_libs = libs
 
+    def build_extension(self, ext):
+        if self._pch_headers is not None:
+            self._build_pch(ext)
+        build_ext.build_extension(self, ext)
+
+    def _build_pch(self, ext) -> None:
+        # Precompiles the header that is included before each generated
+        # source, using the same options that the sources are compiled with
+        # so that the compiler can use it
+        wrapper = getattr(ext, "rpybuild_wrapper", None)
+        if wrapper is None:
+            return
+
+        header = wrapper.write_pch_header()
+        if header is None:
+            return
+
+        header = abspath(header)
+        pch = header + ".gch"
+
+        macros = ext.define_macros[:]
+        for undef in ext.undef_macros:
+            macros.append((undef,))
+
+        _, _, extra_postargs, pp_opts, _ = self.compiler._setup_compile(
+            self.build_temp,
+            macros,
+            ext.include_dirs,
+            [],
+            ext.depends,
+            ext.extra_compile_args or [],
+        )
+        cc_args = self.compiler._get_cc_args(pp_opts, self.debug, None)
+
+        try:
+            self.compiler._compile(
+                pch,
+                header,
+                ".h",
+                cc_args + ["-x", "c++-header"],
+                extra_postargs,
+                pp_opts,
+            )
+        except setuptools.distutils.errors.CompileError:
+            print(f"WARNING: could not precompile {header}, building without it")
+            if os.path.exists(pch):
+                os.unlink(pch)
+            return
+
+        for src in wrapper.get_generated_sources():
+            self._pch_headers[abspath(src)] = header
+
     def resolve_libs(self):
         # used in _built_env
         platform = get_platform()
@@ -211,50 +551,3 @@ class BuildExt(build_ext):
             libraries = [lib for lib in libraries if not lib.startswith(pythonlib)]
 
         return libraries
-
-
-parallel = int(os.environ.get("RPYBUILD_PARALLEL", "0"))
-if parallel > 0:
-    # don't enable this hack by default, because not really sure of the
-    # ramifications -- however, it's really useful for development
-    #
-    # .. the real answer to this is cmake o_O
-
-    # monkey-patch for parallel compilation
-    # -> https://stackoverflow.com/questions/11013851/speeding-up-build-process-with-distutils/13176803#13176803
-    def parallelCCompile(
-        self,
-        sources,
-        output_dir=None,
-        macros=None,
-        include_dirs=None,
-        debug=0,
-        extra_preargs=None,
-        extra_postargs=None,
-        depends=None,
-    ):
-        # those lines are copied from distutils.ccompiler.CCompiler directly
-        macros, objects, extra_postargs, pp_opts, build = self._setup_compile(
-            output_dir, macros, include_dirs, sources, depends, extra_postargs
-        )
-        cc_args = self._get_cc_args(pp_opts, debug, extra_preargs)
-        # parallel code
-        import multiprocessing
-        import multiprocessing.pool
-
-        N = multiprocessing.cpu_count() if parallel == 1 else parallel
-
-        def _single_compile(obj):
-            try:
-                src, ext = build[obj]
-            except KeyError:
-                return
-            self._compile(obj, src, ext, cc_args, extra_postargs, pp_opts)
-
-        for _ in multiprocessing.pool.ThreadPool(N).imap(_single_compile, objects):
-            pass
-        return objects
-
-    import distutils.ccompiler
-
-    distutils.ccompiler.CCompiler.compile = parallelCCompile
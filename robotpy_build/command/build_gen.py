@@ -2,7 +2,7 @@ from distutils.core import Command
 from typing import List
 import os.path
 
-from ..wrapper import Wrapper
+from ..wrapper import Wrapper, get_gen_parallel_jobs
 
 
 class BuildGen(Command):
@@ -12,24 +12,36 @@ class BuildGen(Command):
         ("build-base=", "b", "base directory for build library"),
         ("build-temp=", "t", "temporary build directory"),
         ("cxx-gen-dir=", "b", "Directory to write generated C++ files"),
+        ("jobs=", "j", "Number of processes to use when generating files"),
+        ("force", "f", "Regenerate all files, even if they are up to date"),
     ]
+    boolean_options = ["force"]
     wrappers: List[Wrapper] = []
 
     def initialize_options(self):
         self.build_base = None
         self.build_temp = None
         self.cxx_gen_dir = None
+        self.jobs = None
+        self.force = None
 
     def finalize_options(self):
         self.set_undefined_options(
-            "build", ("build_base", "build_base"), ("build_temp", "build_temp")
+            "build",
+            ("build_base", "build_base"),
+            ("build_temp", "build_temp"),
+            ("force", "force"),
         )
         if self.cxx_gen_dir is None:
             self.cxx_gen_dir = os.path.join(self.build_temp, "gensrc")
+        if self.jobs is None:
+            self.jobs = get_gen_parallel_jobs()
+        else:
+            self.jobs = int(self.jobs)
 
     def run(self):
         # files need to be downloaded before building can occur
         self.run_command("build_dl")
 
         for wrapper in self.wrappers:
-            wrapper.on_build_gen(self.cxx_gen_dir)
+            wrapper.on_build_gen(self.cxx_gen_dir, jobs=self.jobs, force=self.force)
@@ -0,0 +1,451 @@
+import concurrent.futures
+import json
+import math
+import os
+import re
+import select
+import setuptools
+import subprocess
+import sys
+import time
+import typing
+
+from ..gencache import FileHasher
+
+#: How often to check for a jobserver token while waiting for jobs to finish
+_TOKEN_POLL_INTERVAL = 0.05
+
+#: Memory that a source is expected to use if it has never been compiled
+#: and nothing else has been either
+_DEFAULT_PEAK_RSS = 1024 * 1024 * 1024
+
+#: Runs a job. Returns None if nothing needed to be compiled, otherwise the
+#: peak memory used by the compiler (0 if unknown)
+CompileJob = typing.Callable[[], typing.Optional[int]]
+
+
+def get_compile_jobs(parallel: typing.Union[None, bool, int] = None) -> int:
+    """
+    Returns the maximum number of sources to compile at once. If
+    RPYBUILD_PARALLEL is set, 1 uses a job per CPU, 0 compiles a single
+    source at a time, and other values are the number of jobs. Otherwise
+    parallel (build_ext's --parallel option) is used if specified, and the
+    default is a job per CPU.
+    """
+    env = os.environ.get("RPYBUILD_PARALLEL")
+    if env is not None:
+        jobs = int(env)
+        if jobs == 1:
+            return os.cpu_count() or 1
+        return max(jobs, 1)
+
+    if parallel is None or parallel is True:
+        return os.cpu_count() or 1
+    return max(int(parallel), 1)
+
+
+def get_memory_budget() -> typing.Optional[int]:
+    """
+    Returns the amount of memory (in bytes) that the sources being compiled
+    at once can use. RPYBUILD_COMPILE_MEMORY sets it in MB (0 for no limit).
+    Otherwise it is the memory available when the build starts, which can
+    only be determined on Linux (None elsewhere).
+    """
+    env = os.environ.get("RPYBUILD_COMPILE_MEMORY")
+    if env is not None:
+        budget = int(env) * 1024 * 1024
+        return budget if budget > 0 else None
+
+    available = None
+    try:
+        with open("/proc/meminfo") as fp:
+            for line in fp:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError):
+        pass
+
+    # Containers such as CI runners often have less memory than the host
+    try:
+        with open("/sys/fs/cgroup/memory.max") as fp:
+            limit = fp.read().strip()
+        with open("/sys/fs/cgroup/memory.current") as fp:
+            current = int(fp.read())
+        if limit != "max":
+            cgroup_available = max(int(limit) - current, 0)
+            if available is None or cgroup_available < available:
+                available = cgroup_available
+    except (OSError, ValueError):
+        pass
+
+    return available
+
+
+def spawn_measured(cmd: typing.List[str], dry_run: bool = False) -> int:
+    """
+    Runs a command in the same way as distutils' spawn, and returns the
+    peak memory (in bytes) used by the command or any process that it ran.
+    Requires os.wait4.
+    """
+    distutils = setuptools.distutils
+    distutils.log.info(subprocess.list2cmdline(cmd))
+    if dry_run:
+        return 0
+
+    env = None
+    if sys.platform == "darwin":
+        macosx_target_ver = distutils.util.get_macosx_target_ver()
+        if macosx_target_ver:
+            env = dict(os.environ)
+            env[distutils.util.MACOSX_VERSION_VAR] = macosx_target_ver
+
+    try:
+        proc = subprocess.Popen(cmd, env=env)
+    except OSError as exc:
+        raise distutils.errors.DistutilsExecError(
+            f"command {cmd[0]!r} failed: {exc.args[-1]}"
+        ) from exc
+
+    _, status, rusage = os.wait4(proc.pid, 0)
+    if os.WIFEXITED(status):
+        proc.returncode = os.WEXITSTATUS(status)
+    else:
+        proc.returncode = -os.WTERMSIG(status)
+
+    if proc.returncode:
+        raise distutils.errors.DistutilsExecError(
+            f"command {cmd[0]!r} failed with exit code {proc.returncode}"
+        )
+
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == "darwin":
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024
+
+
+class CompileHistory:
+    """
+    Records how long it took to compile each source and the peak memory used
+    the last time that it was compiled, along with the hash of the source.
+    Stored as JSON in the build directory.
+    """
+
+    #: Increment when the format of the history changes
+    FORMAT = 2
+
+    def __init__(self, fname: str) -> None:
+        self.fname = fname
+        self.sources: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+        self._by_hash: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+        self._changed = False
+
+        try:
+            with open(fname, encoding="utf-8") as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return
+
+        if data.get("format") == self.FORMAT:
+            self.sources = data["sources"]
+            for entry in self.sources.values():
+                if entry.get("hash") is not None:
+                    self._by_hash[entry["hash"]] = entry
+
+    def get_peak_rss(self, src: str) -> typing.Optional[int]:
+        entry = self.sources.get(src)
+        return entry.get("peak_rss") if entry is not None else None
+
+    def get_duration(
+        self, src: str, src_hash: typing.Optional[str]
+    ) -> typing.Optional[float]:
+        """
+        Returns how long the source is expected to take to compile. If the
+        source changed, the time recorded for a source with the same content
+        (such as a generated file that was renamed) is preferred over the
+        time recorded for the old content of the source.
+        """
+        entry = self.sources.get(src)
+        if entry is None or entry.get("hash") != src_hash:
+            entry = self._by_hash.get(src_hash, entry)
+        return entry.get("duration") if entry is not None else None
+
+    def record(
+        self,
+        src: str,
+        src_hash: typing.Optional[str],
+        duration: float,
+        peak_rss: typing.Optional[int],
+    ) -> None:
+        entry: typing.Dict[str, typing.Any] = {
+            "hash": src_hash,
+            "duration": round(duration, 3),
+        }
+        if peak_rss:
+            entry["peak_rss"] = peak_rss
+        else:
+            # keep the old measurement if the compiler wasn't measured
+            old_peak_rss = self.get_peak_rss(src)
+            if old_peak_rss is not None:
+                entry["peak_rss"] = old_peak_rss
+
+        self.sources[src] = entry
+        if src_hash is not None:
+            self._by_hash[src_hash] = entry
+        self._changed = True
+
+    def save(self) -> None:
+        if not self._changed:
+            return
+
+        data = {"format": self.FORMAT, "sources": self.sources}
+        tmpname = f"{self.fname}.tmp"
+        with open(tmpname, "w", encoding="utf-8") as fp:
+            json.dump(data, fp)
+        os.replace(tmpname, self.fname)
+        self._changed = False
+
+
+class JobServer:
+    """
+    Client for the jobserver that GNU make uses to limit the number of jobs
+    running at once across all of the programs that it runs. A program can
+    always run one job, and each additional job needs a token that is read
+    from the jobserver. Tokens must be written back when the job is done.
+    """
+
+    def __init__(self, rfd: int, wfd: int, owns_fds: bool = False) -> None:
+        self.rfd = rfd
+        self.wfd = wfd
+        #: If True, the file descriptors are closed by close
+        self.owns_fds = owns_fds
+
+    @classmethod
+    def from_environ(cls) -> typing.Optional["JobServer"]:
+        """
+        Returns the jobserver specified in MAKEFLAGS, or None if there isn't
+        one. Raises OSError if make specified a jobserver that can't be used,
+        which happens when the recipe that runs robotpy-build isn't marked
+        with '+'.
+        """
+        # make uses a semaphore on Windows, which isn't supported
+        if os.name == "nt":
+            return None
+
+        makeflags = os.environ.get("MAKEFLAGS", "")
+        auths = re.findall(r"--jobserver-(?:auth|fds)=(\S+)", makeflags)
+        if not auths:
+            return None
+
+        auth = auths[-1]
+        if auth.startswith("fifo:"):
+            fd = os.open(auth[5:], os.O_RDWR)
+            return cls(fd, fd, owns_fds=True)
+
+        rfd, wfd = (int(fd) for fd in auth.split(","))
+        os.fstat(rfd)
+        os.fstat(wfd)
+        return cls(rfd, wfd)
+
+    def try_acquire(self) -> typing.Optional[bytes]:
+        """Returns a token if one is available, otherwise None"""
+        # The pipe is shared with other processes, so this may block if one
+        # of them takes the token first.. but only until a token is returned
+        readable, _, _ = select.select([self.rfd], [], [], 0)
+        if not readable:
+            return None
+        try:
+            token = os.read(self.rfd, 1)
+        except BlockingIOError:
+            return None
+        return token or None
+
+    def release(self, token: bytes) -> None:
+        os.write(self.wfd, token)
+
+    def close(self) -> None:
+        """Closes the jobserver if it was opened by from_environ"""
+        if self.owns_fds:
+            self.owns_fds = False
+            os.close(self.rfd)
+            if self.wfd != self.rfd:
+                os.close(self.wfd)
+
+
+class CompileScheduler:
+    """
+    Runs compile jobs in threads (the work is done by compiler processes).
+    At most max_jobs run at once, and if there is a jobserver, each job
+    other than the first needs a token from it.
+
+    Jobs that are expected to take the longest (according to the time
+    recorded in history) are started first, so that a slow source isn't
+    left to compile by itself at the end of the build. Sources that don't
+    have a recorded time are started before all others.
+
+    If a memory budget is specified, jobs are only started if the memory
+    that they are expected to use (the peak memory recorded in history the
+    last time that the same source was compiled) fits in the budget along
+    with the jobs that are running. A job is always started if nothing
+    else is running.
+    """
+
+    def __init__(
+        self,
+        max_jobs: int,
+        jobserver: typing.Optional[JobServer] = None,
+        memory_budget: typing.Optional[int] = None,
+        history: typing.Optional[CompileHistory] = None,
+    ) -> None:
+        self.max_jobs = max(max_jobs, 1)
+        self.jobserver = jobserver
+        self.memory_budget = memory_budget
+        self.history = history
+
+    def run(self, jobs: typing.Sequence[typing.Tuple[str, CompileJob]]) -> None:
+        """
+        Runs all of the jobs, which are named after the source that they
+        compile. If a job fails, no more jobs are started, and the error is
+        raised once the running jobs are finished.
+        """
+        # hash the sources before they are compiled, in case they change
+        hashes: typing.Dict[str, typing.Optional[str]] = {}
+        if self.history is not None:
+            hasher = FileHasher()
+            hashes = {name: hasher.hash(name) for name, _ in jobs}
+
+        try:
+            if self.max_jobs == 1 or len(jobs) <= 1:
+                for name, job in jobs:
+                    self._record(name, hashes, _timed(job)())
+            else:
+                self._run_parallel(jobs, hashes)
+        finally:
+            if self.history is not None:
+                self.history.save()
+
+    def _run_parallel(
+        self,
+        jobs: typing.Sequence[typing.Tuple[str, CompileJob]],
+        hashes: typing.Dict[str, typing.Optional[str]],
+    ):
+        # (name, job, expected memory usage)
+        pending = []
+        if self.history is None:
+            for name, job in jobs:
+                pending.append((name, job, 0))
+        else:
+            # assume that new sources are as bad as the worst known source
+            unknown = max(
+                (
+                    entry["peak_rss"]
+                    for entry in self.history.sources.values()
+                    if "peak_rss" in entry
+                ),
+                default=_DEFAULT_PEAK_RSS,
+            )
+            durations = {}
+            for name, job in jobs:
+                peak_rss = self.history.get_peak_rss(name)
+                pending.append((name, job, unknown if peak_rss is None else peak_rss))
+                duration = self.history.get_duration(name, hashes[name])
+                durations[name] = math.inf if duration is None else duration
+
+            # longest first; sort is stable, so ties keep the original order
+            pending.sort(key=lambda p: durations[p[0]], reverse=True)
+
+        # Running jobs, the jobserver token they hold, and their expected
+        # memory usage. The job that doesn't need a token has None, and b""
+        # is used if there isn't a jobserver
+        running: typing.Dict[
+            concurrent.futures.Future, typing.Tuple[str, typing.Optional[bytes], int]
+        ] = {}
+        memory_used = 0
+        error: typing.Optional[BaseException] = None
+
+        with concurrent.futures.ThreadPoolExecutor(self.max_jobs) as executor:
+            try:
+                while running or (pending and error is None):
+                    waiting_for_token = False
+                    while pending and error is None and len(running) < self.max_jobs:
+                        idx = self._next_job(pending, memory_used, bool(running))
+                        if idx is None:
+                            break
+
+                        if all(token is not None for _, token, _ in running.values()):
+                            token = None
+                        elif self.jobserver is None:
+                            token = b""
+                        else:
+                            token = self.jobserver.try_acquire()
+                            if token is None:
+                                waiting_for_token = True
+                                break
+
+                        name, job, memory = pending.pop(idx)
+                        running[executor.submit(_timed(job))] = (name, token, memory)
+                        memory_used += memory
+
+                    done, _ = concurrent.futures.wait(
+                        running,
+                        timeout=_TOKEN_POLL_INTERVAL if waiting_for_token else None,
+                        return_when=concurrent.futures.FIRST_COMPLETED,
+                    )
+                    for future in done:
+                        name, token, memory = running.pop(future)
+                        self._release(token)
+                        memory_used -= memory
+
+                        exc = future.exception()
+                        if exc is None:
+                            self._record(name, hashes, future.result())
+                        elif error is None:
+                            error = exc
+            finally:
+                # tokens must always be returned to make
+                if running:
+                    concurrent.futures.wait(running)
+                    for _, token, _ in running.values():
+                        self._release(token)
+
+        if error is not None:
+            raise error
+
+    def _next_job(
+        self,
+        pending: typing.List[typing.Tuple[str, CompileJob, int]],
+        memory_used: int,
+        jobs_running: bool,
+    ) -> typing.Optional[int]:
+        # the first job that fits in the memory budget
+        if self.memory_budget is None or not jobs_running:
+            return 0
+        for idx, (_, _, memory) in enumerate(pending):
+            if memory_used + memory <= self.memory_budget:
+                return idx
+        return None
+
+    def _record(
+        self,
+        name: str,
+        hashes: typing.Dict[str, typing.Optional[str]],
+        result: typing.Tuple[typing.Optional[int], float],
+    ) -> None:
+        peak_rss, duration = result
+        if peak_rss is not None and self.history is not None:
+            self.history.record(name, hashes[name], duration, peak_rss)
+
+    def _release(self, token: typing.Optional[bytes]) -> None:
+        if token and self.jobserver is not None:
+            self.jobserver.release(token)
+
+
+def _timed(
+    job: CompileJob,
+) -> typing.Callable[[], typing.Tuple[typing.Optional[int], float]]:
+    def _run():
+        start = time.perf_counter()
+        peak_rss = job()
+        return peak_rss, time.perf_counter() - start
+
+    return _run
@@ -4,12 +4,21 @@
 #
 
 import enum
+import functools
+import sys
 from typing import Dict, List, Tuple, Optional
 
+import pydantic
 from pydantic import validator, Field
+from . import util
 from .util import Model, _generating_documentation
+from ..diskcache import get_cache
+from ..gencache import compute_key, hash_bytes, hash_modules
 import yaml
 
+# libyaml is much faster than the pure python loader
+_yaml_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 class ParamData(Model):
     """Various ways to modify parameters"""
@@ -480,6 +489,17 @@ class Defaults(Model):
     report_ignored_missing: bool = True
 
 
+class ShardBy(enum.Enum):
+    """How the classes in a header are divided between shards."""
+
+    #: Each shard binds about the same amount of code, estimated from the
+    #: number of methods, properties and enums of each class
+    SIZE = "size"
+
+    #: Each shard binds about the same number of classes
+    CLASS = "class"
+
+
 class AutowrapConfigYaml(Model):
     """
     Format of the file in [tool.robotpy-build.wrappers."PACKAGENAME"]
@@ -579,6 +599,42 @@ class AutowrapConfigYaml(Model):
     #: Encoding to use when opening this header file
     encoding: str = "utf-8-sig"
 
+    #: Set this to False to always preprocess this header using pcpp instead
+    #: of the native (gcc or clang) preprocessor, such as when the native
+    #: preprocessor output cannot be parsed. The native preprocessor is used
+    #: by default when one is found, see ``RPYBUILD_PP``.
+    native_preprocessor: bool = True
+
+    #: Splits the code that binds the classes in this header between this
+    #: many C++ files, which are compiled separately. This reduces the time
+    #: and memory needed to compile a header with many classes, and allows
+    #: the parts to be compiled in parallel. Classes are bound in the same
+    #: order as they would be if the header wasn't split.
+    #:
+    #: .. note:: ``inline_code`` is inserted into the first file, so it can
+    #:           only refer to the classes that are bound in that file
+    #:
+    #: .. code-block:: yaml
+    #:
+    #:    shards: 4
+    #:
+    shards: int = 1
+
+    #: How classes are divided between shards
+    shard_by: ShardBy = ShardBy.SIZE
+
+    #: Set this to False to never combine the generated sources of this
+    #: header with those of other headers when ``RPYBUILD_UNITY`` is set,
+    #: such as when the header defines something at global scope that
+    #: conflicts with another header.
+    unity: bool = True
+
+    @validator("shards")
+    def validate_shards(cls, value):
+        if value < 1:
+            raise ValueError("must be at least 1")
+        return value
+
     @validator("attributes", pre=True)
     def validate_attributes(cls, value):
         for k, v in value.items():
@@ -610,9 +666,37 @@ class AutowrapConfigYaml(Model):
     @classmethod
     def from_file(cls, fname) -> "AutowrapConfigYaml":
         with open(fname) as fp:
-            data = yaml.safe_load(fp)
+            content = fp.read()
+
+        # Validated data is cached, as loading and validating very large
+        # files can be slow
+        cache = get_cache("gendata")
+        if cache is not None:
+            key = compute_key(
+                model=_get_model_id(),
+                name=cls.__name__,
+                content=hash_bytes(content.encode("utf-8", "surrogateescape")),
+            )
+            cached = cache.get_pickle(key)
+            if isinstance(cached, cls):
+                return cached
 
+        data = yaml.load(content, Loader=_yaml_loader)
         if data is None:
             data = {}
 
-        return cls(**data)
+        result = cls(**data)
+
+        if cache is not None:
+            cache.put_pickle(key, result)
+
+        return result
+
+
+@functools.lru_cache(maxsize=None)
+def _get_model_id() -> str:
+    # Cached models must be discarded when their definitions change
+    return compute_key(
+        modules=hash_modules([sys.modules[__name__], util]),
+        pydantic=pydantic.VERSION,
+    )
@@ -18,6 +18,13 @@ class DevConfig(Model):
     #: Useful in conjunction with ccache
     only_generate: Optional[List[str]] = None
 
+    #: When set, each header that is generated is profiled using cProfile and
+    #: the results are written to ``PROFILE_DIR/WRAPPER/HEADER.prof``, along
+    #: with ``all.prof`` which combines the results of every header. Caches
+    #: of preprocessed and parsed headers are not used while profiling. This
+    #: can also be set using the RPYBUILD_GEN_PROFILE environment variable.
+    profile_dir: Optional[str] = None
+
 
 def get_dev_config(name: str) -> Optional[DevConfig]:
     # name is the wrapper config, not used currently
@@ -28,4 +35,11 @@ def get_dev_config(name: str) -> Optional[DevConfig]:
     else:
         data = {}
 
+    if data is None:
+        data = {}
+
+    profile_dir = os.environ.get("RPYBUILD_GEN_PROFILE")
+    if profile_dir:
+        data.setdefault("profile_dir", profile_dir)
+
     return DevConfig(**data)
@@ -0,0 +1,183 @@
+#
+# A simple persistent cache that stores each entry in a separate file, which
+# makes it safe to use from multiple processes at the same time
+#
+
+import os
+from os.path import expanduser, join
+import pickle
+import sys
+import typing
+
+
+def get_cache_root() -> str:
+    """
+    Directory that robotpy-build stores persistent caches in. Can be
+    overridden by setting the RPYBUILD_CACHE_DIR environment variable.
+    """
+    root = os.environ.get("RPYBUILD_CACHE_DIR")
+    if root:
+        return root
+
+    if sys.platform.startswith("win32"):
+        base = os.environ.get("LOCALAPPDATA") or expanduser("~")
+    elif sys.platform.startswith("darwin"):
+        base = join(expanduser("~"), "Library", "Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or join(expanduser("~"), ".cache")
+
+    return join(base, "robotpy-build")
+
+
+#: Caches stored in the cache root. The value is the environment variable
+#: that sets the maximum size of the cache in MB, and its default value.
+#: Setting the size to 0 disables the cache.
+CACHES = {
+    "preprocessed": ("RPYBUILD_PP_CACHE_SIZE", 1024),
+    "parsed": ("RPYBUILD_PARSED_CACHE_SIZE", 512),
+    "docs": ("RPYBUILD_DOC_CACHE_SIZE", 128),
+    "gendata": ("RPYBUILD_GENDATA_CACHE_SIZE", 128),
+    "probes": ("RPYBUILD_PROBE_CACHE_SIZE", 1),
+}
+
+
+def get_cache_size(name: str) -> int:
+    """Maximum size of the named cache in bytes"""
+    envvar, default_mb = CACHES[name]
+    return int(float(os.environ.get(envvar, default_mb)) * 1024 * 1024)
+
+
+def get_cache(name: str) -> typing.Optional["DiskCache"]:
+    """Returns the named cache, or None if it is disabled"""
+    max_size = get_cache_size(name)
+    if max_size <= 0:
+        return None
+    return DiskCache(join(get_cache_root(), name), max_size)
+
+
+class DiskCache:
+    """
+    Maps keys (hex strings such as those returned by compute_key) to bytes.
+    When the cache grows larger than max_size, the least recently used
+    entries are removed by prune.
+    """
+
+    def __init__(self, path: str, max_size: int) -> None:
+        self.path = path
+        self.max_size = max_size
+
+    def _entry_path(self, key: str) -> str:
+        return join(self.path, key[:2], key[2:])
+
+    def get(self, key: str) -> typing.Optional[bytes]:
+        return self._read(key, lambda fp: fp.read())
+
+    def get_pickle(self, key: str) -> typing.Any:
+        """
+        Returns the object pickled by put_pickle, or None if it can't be
+        loaded. The object is read directly from the cache file.
+        """
+        return self._read(key, pickle.load)
+
+    def _read(self, key: str, read: typing.Callable[[typing.BinaryIO], typing.Any]):
+        fname = self._entry_path(key)
+        try:
+            with open(fname, "rb") as fp:
+                data = read(fp)
+        except OSError:
+            return None
+        except Exception:
+            # corrupt pickle, or one that refers to something that no longer
+            # exists
+            return None
+
+        # mtime is used to track when an entry was last used
+        try:
+            os.utime(fname)
+        except OSError:
+            pass
+
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        self._write(key, lambda fp: fp.write(data))
+
+    def put_pickle(self, key: str, obj: typing.Any) -> None:
+        """Pickles obj directly to the cache file"""
+        self._write(
+            key, lambda fp: pickle.dump(obj, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        )
+
+    def _write(self, key: str, write: typing.Callable[[typing.BinaryIO], typing.Any]):
+        fname = self._entry_path(key)
+        tmpname = f"{fname}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            with open(tmpname, "wb") as fp:
+                write(fp)
+            os.replace(tmpname, fname)
+        except Exception as e:
+            # failing to write to a cache isn't fatal, but an object that
+            # can't be pickled is unexpected
+            if not isinstance(e, OSError):
+                print(f"WARNING: could not write to cache {self.path}: {e!r}")
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+
+    def _entries(self) -> typing.List[typing.Tuple[float, int, str]]:
+        entries = []
+        try:
+            subdirs = os.listdir(self.path)
+        except OSError:
+            return entries
+
+        for subdir in subdirs:
+            try:
+                it = os.scandir(join(self.path, subdir))
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+
+        return entries
+
+    def stats(self) -> typing.Tuple[int, int]:
+        """Returns (number of entries, total size in bytes)"""
+        entries = self._entries()
+        return len(entries), sum(e[1] for e in entries)
+
+    def prune(self, max_size: typing.Optional[int] = None) -> typing.Tuple[int, int]:
+        """
+        Removes least recently used entries until the cache is no larger
+        than max_size. Returns (number of entries, bytes) removed.
+        """
+        if max_size is None:
+            max_size = self.max_size
+
+        entries = self._entries()
+        size = sum(e[1] for e in entries)
+        removed = 0
+        removed_size = 0
+
+        for _, esize, fname in sorted(entries):
+            if size <= max_size:
+                break
+            try:
+                os.unlink(fname)
+            except OSError:
+                continue
+            size -= esize
+            removed += 1
+            removed_size += esize
+
+        return removed, removed_size
+
+    def clear(self) -> typing.Tuple[int, int]:
+        return self.prune(0)
@@ -0,0 +1,211 @@
+#
+# Supports skipping generation of headers whose inputs have not changed
+#
+
+import hashlib
+import json
+import os
+from os.path import exists
+import shutil
+import types
+import typing
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def compute_key(**parts) -> str:
+    """Computes a stable hash of a set of JSON-serializable values"""
+    return hash_bytes(json.dumps(parts, sort_keys=True).encode("utf-8"))
+
+
+class FileHasher:
+    """
+    Computes content hashes of files, and remembers them so that headers
+    included by many other headers are only read once per build
+    """
+
+    def __init__(self) -> None:
+        self._hashes: typing.Dict[str, typing.Optional[str]] = {}
+
+    def hash(self, fname: str) -> typing.Optional[str]:
+        """Returns None if the file does not exist"""
+        try:
+            return self._hashes[fname]
+        except KeyError:
+            pass
+
+        try:
+            with open(fname, "rb") as fp:
+                h: typing.Optional[str] = hash_bytes(fp.read())
+        except FileNotFoundError:
+            h = None
+
+        self._hashes[fname] = h
+        return h
+
+
+def identify_executables(
+    cmd: typing.Sequence[str],
+) -> typing.Dict[str, typing.List[int]]:
+    """
+    Identifies the executables at the start of a command (such as
+    'ccache g++') by their size and mtime, so that cache keys that include
+    them change when a compiler is upgraded
+    """
+    executables = {}
+    for arg in cmd:
+        if arg.startswith("-"):
+            break
+        path = shutil.which(arg)
+        if path is None:
+            break
+        try:
+            st = os.stat(path)
+        except OSError:
+            break
+        executables[path] = [st.st_size, st.st_mtime_ns]
+    return executables
+
+
+def format_depfile(deps: typing.Dict[str, str]) -> str:
+    """
+    A depfile records every file that the preprocessor read while processing
+    a header, along with the content hash of each file
+    """
+    return json.dumps({"deps": dict(sorted(deps.items()))}, indent=1)
+
+
+def load_depfile(fname: str) -> typing.Optional[typing.Dict[str, str]]:
+    """Returns the dependencies recorded in a depfile, or None if it is invalid"""
+    try:
+        with open(fname, encoding="utf-8") as fp:
+            return json.load(fp)["deps"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_depfile(
+    fname: str, hasher: FileHasher
+) -> typing.Optional[typing.Dict[str, str]]:
+    """
+    Returns the dependencies recorded in a depfile, or None if the depfile
+    doesn't exist or any of the files recorded in it have changed
+    """
+    deps = load_depfile(fname)
+    if deps is None:
+        return None
+
+    for path, h in deps.items():
+        if hasher.hash(path) != h:
+            return None
+
+    return deps
+
+
+def depfile_is_current(fname: str, hasher: FileHasher) -> bool:
+    """Returns True if none of the files recorded in a depfile have changed"""
+    return read_depfile(fname, hasher) is not None
+
+
+def hash_modules(modules: typing.Iterable[types.ModuleType]) -> str:
+    """Computes a hash of the source code of python modules"""
+    hasher = FileHasher()
+    return compute_key(
+        **{m.__name__: hasher.hash(m.__file__) for m in modules if m.__file__}
+    )
+
+
+class GenerationManifest:
+    """
+    Records the inputs and outputs of each header that has been generated, so
+    that a future build can skip headers that haven't changed. Stored as JSON
+    in the generated source directory.
+    """
+
+    #: Increment when the format of the manifest changes
+    FORMAT = 3
+
+    def __init__(self, fname: str) -> None:
+        self.fname = fname
+        self.entries: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+
+        try:
+            with open(fname, encoding="utf-8") as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return
+
+        if data.get("format") == self.FORMAT:
+            self.entries = data["headers"]
+
+    def get(self, name: str, key: str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        """
+        Returns the entry for a header if its inputs are the same as when it
+        was last generated, and all of its outputs still exist
+        """
+        entry = self.entries.get(name)
+        if entry is None or entry["key"] != key:
+            return None
+
+        for output in entry["outputs"]:
+            if not exists(output):
+                return None
+
+        return entry
+
+    def update(
+        self,
+        name: str,
+        key: str,
+        outputs: typing.List[str],
+        generated_sources: typing.List[str],
+        missing_reports: typing.Dict[str, typing.Any],
+        type_caster_includes: typing.List[str],
+        unity: bool,
+    ) -> None:
+        """
+        Records the result of generating a header, and removes outputs from
+        the previous generation that are no longer produced
+        """
+        old = self.entries.get(name)
+        if old is not None:
+            # the same output may be recorded with a relative or absolute path
+            current = {os.path.abspath(output) for output in outputs}
+            _remove_files(
+                output
+                for output in old["outputs"]
+                if os.path.abspath(output) not in current
+            )
+
+        self.entries[name] = {
+            "key": key,
+            "outputs": outputs,
+            "generated_sources": generated_sources,
+            "missing_reports": missing_reports,
+            "type_caster_includes": type_caster_includes,
+            "unity": unity,
+        }
+
+    def remove_stale(self, names: typing.Iterable[str]) -> None:
+        """Removes outputs of headers that are no longer being generated"""
+        keep = set(names)
+        for name in list(self.entries):
+            if name not in keep:
+                _remove_files(self.entries.pop(name)["outputs"])
+
+    def save(self) -> None:
+        data = {"format": self.FORMAT, "headers": self.entries}
+        tmpname = f"{self.fname}.tmp"
+        with open(tmpname, "w", encoding="utf-8") as fp:
+            json.dump(data, fp)
+        os.replace(tmpname, self.fname)
+
+
+def _remove_files(fnames: typing.Iterable[str]) -> None:
+    for fname in fnames:
+        try:
+            os.unlink(fname)
+        except FileNotFoundError:
+            pass
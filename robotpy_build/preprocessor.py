@@ -0,0 +1,535 @@
+#
+# Preprocessors used when parsing headers. These are similar to the ones
+# provided by cxxheaderparser, but they also record the files that were
+# included so that we can tell when a header needs to be regenerated
+#
+
+import functools
+import io
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+import typing
+
+from cxxheaderparser.options import PreprocessorFunction
+from cxxheaderparser.preprocessor import PreprocessorError
+import pcpp
+from pcpp import Action, OutputDirective
+from pcpp.parser import LexToken
+
+from .diskcache import DiskCache
+from .gencache import FileHasher, compute_key, hash_bytes, identify_executables
+from .version import version
+
+#: Maps the path of each file read by the preprocessor to its content hash
+Dependencies = typing.Dict[str, str]
+
+
+def _read_text(data: bytes, encoding: typing.Optional[str]) -> io.TextIOWrapper:
+    # equivalent to opening the file in text mode
+    return io.TextIOWrapper(io.BytesIO(data), encoding=encoding)
+
+
+#
+# pcpp
+#
+
+
+class IncludeCache:
+    """
+    Remembers the contents of files read by pcpp and the tokens produced by
+    lexing them, so that when many headers are preprocessed in a single run
+    the files that they all include are only read and tokenized once.
+
+    Only the parts of preprocessing that don't depend on the macros that are
+    defined are cached: the included files are still processed for every
+    header. Files aren't expected to change while the cache is alive.
+    """
+
+    def __init__(self) -> None:
+        # path: (content, hash) or None if the file could not be opened
+        self._files: typing.Dict[str, typing.Optional[typing.Tuple[bytes, str]]] = {}
+        # (source, text): (type, value, lineno, lexpos) of each token of each line
+        self._lines: typing.Dict[
+            typing.Tuple[str, str],
+            typing.List[typing.List[typing.Tuple[str, str, int, int]]],
+        ] = {}
+
+    def read(self, path: str) -> typing.Tuple[bytes, str]:
+        """Returns (content, hash) of a file, or raises OSError"""
+        try:
+            entry = self._files[path]
+        except KeyError:
+            try:
+                with open(path, "rb") as fp:
+                    data = fp.read()
+            except OSError:
+                entry = None
+            else:
+                entry = (data, hash_bytes(data))
+            self._files[path] = entry
+
+        if entry is None:
+            raise FileNotFoundError(path)
+        return entry
+
+    def group_lines(
+        self, pp: pcpp.Preprocessor, input: str, abssource: str
+    ) -> typing.Iterator[typing.List[LexToken]]:
+        key = (abssource, input)
+        lines = self._lines.get(key)
+
+        if lines is None:
+            lines = []
+            for line in pcpp.Preprocessor.group_lines(pp, input, abssource):
+                lines.append([(t.type, t.value, t.lineno, t.lexpos) for t in line])
+                yield line
+
+            # only remember files that were completely tokenized
+            self._lines[key] = lines
+            return
+
+        # pcpp modifies tokens as it processes them, so create new ones
+        for line in lines:
+            new_line = []
+            for type, value, lineno, lexpos in line:
+                tok = LexToken()
+                tok.type = type
+                tok.value = value
+                tok.lineno = lineno
+                tok.lexpos = lexpos
+                tok.source = abssource
+                new_line.append(tok)
+            yield new_line
+
+
+class _PcppPreprocessor(pcpp.Preprocessor):
+    def __init__(
+        self,
+        encoding: typing.Optional[str],
+        deps: Dependencies,
+        include_cache: typing.Optional[IncludeCache],
+    ):
+        pcpp.Preprocessor.__init__(self)
+        self.errors: typing.List[str] = []
+        self.assume_encoding = encoding
+        self.passthru_includes = None
+        self.deps = deps
+        self.include_cache = include_cache
+
+    def on_error(self, file, line, msg):
+        self.errors.append(f"{file}:{line} error: {msg}")
+
+    def on_include_not_found(self, *ignored):
+        raise OutputDirective(Action.IgnoreAndPassThrough)
+
+    def on_comment(self, *ignored):
+        return True
+
+    def on_file_open(self, is_system_include, includepath):
+        # This is also used to probe for files, so this must raise an
+        # OSError if the file doesn't exist
+        if self.include_cache is not None:
+            data, self.deps[includepath] = self.include_cache.read(includepath)
+        else:
+            with open(includepath, "rb") as fp:
+                data = fp.read()
+            self.deps[includepath] = hash_bytes(data)
+
+        ret = _read_text(data, self.assume_encoding)
+        bom = ret.read(1)
+        if bom != "\ufeff":
+            ret.seek(0)
+        return ret
+
+    def group_lines(self, input, abssource):
+        # the header being preprocessed is rarely included by anything else,
+        # so only included files are worth caching
+        if self.include_cache is not None and self.include_depth > 0:
+            return self.include_cache.group_lines(self, input, abssource)
+        return pcpp.Preprocessor.group_lines(self, input, abssource)
+
+
+def _pcpp_filter(fname: str, fp: typing.TextIO) -> str:
+    # the output of pcpp includes the contents of all the included files, so
+    # strip out any content that isn't in our original file
+
+    line_ending = f'{fname}"\n'
+
+    new_output = io.StringIO()
+    keep = True
+
+    for line in fp:
+        if line.startswith("#line"):
+            keep = line.endswith(line_ending)
+
+        if keep:
+            new_output.write(line)
+
+    return new_output.getvalue()
+
+
+def make_pcpp_preprocessor(
+    *,
+    defines: typing.List[str],
+    include_paths: typing.List[str],
+    encoding: typing.Optional[str],
+    deps: Dependencies,
+    include_cache: typing.Optional[IncludeCache] = None,
+) -> PreprocessorFunction:
+    def _preprocess_file(filename: str, content: typing.Optional[str]) -> str:
+        pp = _PcppPreprocessor(encoding, deps, include_cache)
+        for p in include_paths:
+            pp.add_path(p)
+
+        for define in defines:
+            pp.define(define)
+
+        pp.line_directive = "#line"
+
+        if content is None:
+            with open(filename, "rb") as fp:
+                data = fp.read()
+            deps[os.path.abspath(filename)] = hash_bytes(data)
+            content = _read_text(data, encoding).read()
+
+        pp.parse(content, filename)
+
+        if pp.errors:
+            raise PreprocessorError("\n".join(pp.errors))
+        elif pp.return_code:
+            raise PreprocessorError("failed with exit code %d" % pp.return_code)
+
+        fp = io.StringIO()
+        pp.write(fp)
+        fp.seek(0)
+
+        # pcpp emits the #line directive using the filename you pass in
+        # but will rewrite it if it's on the include path it uses. This
+        # is copied from pcpp:
+        abssource = os.path.abspath(filename)
+        for rewrite in pp.rewrite_paths:
+            temp = re.sub(rewrite[0], rewrite[1], abssource)
+            if temp != abssource:
+                filename = temp
+                if os.sep != "/":
+                    filename = filename.replace(os.sep, "/")
+                break
+
+        return _pcpp_filter(filename, fp)
+
+    return _preprocess_file
+
+
+#
+# gcc
+#
+
+
+def _gcc_filter(fname: str, fp: typing.TextIO) -> str:
+    new_output = io.StringIO()
+    keep = True
+    fname = fname.replace("\\", "\\\\")
+
+    for line in fp:
+        if line.startswith("# "):
+            last_quote = line.rfind('"')
+            if last_quote != -1:
+                keep = line[:last_quote].endswith(fname)
+
+        if keep:
+            new_output.write(line)
+
+    return new_output.getvalue()
+
+
+def _parse_make_deps(content: str) -> typing.List[str]:
+    # Parses the makefile rule written by gcc -MD
+    content = content.replace("\\\r\n", " ").replace("\\\n", " ")
+    _, _, deps = content.partition(": ")
+    return [
+        dep.replace("\0", " ")
+        for dep in deps.replace("\\ ", "\0").split()
+        if dep != "\\"
+    ]
+
+
+def make_gcc_preprocessor(
+    *,
+    defines: typing.List[str],
+    include_paths: typing.List[str],
+    encoding: typing.Optional[str],
+    deps: Dependencies,
+    gcc_args: typing.List[str] = ["g++"],
+) -> PreprocessorFunction:
+    if not encoding:
+        encoding = "utf-8"
+
+    def _preprocess_file(filename: str, content: typing.Optional[str]) -> str:
+        if content is not None:
+            raise PreprocessorError("only files can be preprocessed")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            depname = os.path.join(tmpdir, "deps.d")
+            cmd = gcc_args + ["-w", "-E", "-C", "-MMD", "-MF", depname]
+
+            for p in include_paths:
+                cmd.append(f"-I{p}")
+            for d in defines:
+                cmd.append(f"-D{d.replace(' ', '=')}")
+
+            cmd.append(filename)
+
+            result: str = subprocess.check_output(cmd, encoding=encoding)
+
+            with open(depname, encoding="utf-8") as fp:
+                dep_files = _parse_make_deps(fp.read())
+
+        for dep in dep_files:
+            with open(dep, "rb") as fp:
+                deps[os.path.abspath(dep)] = hash_bytes(fp.read())
+
+        return _gcc_filter(filename, io.StringIO(result))
+
+    return _preprocess_file
+
+
+#
+# Backend selection
+#
+
+#: Names of the available preprocessors. 'gcc' uses any gcc compatible
+#: compiler (such as clang), which can be 10x faster than pcpp for very
+#: complex files
+PREPROCESSOR_BACKENDS = ("gcc", "pcpp")
+
+#: Errors that cause a header to be preprocessed with pcpp instead
+_backend_errors = (PreprocessorError, subprocess.CalledProcessError, OSError)
+
+
+@functools.lru_cache(maxsize=None)
+def find_native_preprocessor() -> typing.Optional[typing.Tuple[str, ...]]:
+    """
+    Returns the command for a gcc compatible compiler that can be used to
+    preprocess headers, or None if one could not be found. The compiler
+    specified by the CXX environment variable is preferred.
+    """
+    candidates = [["g++"], ["clang++"], ["c++"]]
+    cxx = os.environ.get("CXX")
+    if cxx:
+        candidates.insert(0, shlex.split(cxx))
+
+    for args in candidates:
+        if not args or shutil.which(args[0]) is None:
+            continue
+
+        try:
+            result = subprocess.run(
+                args + ["-x", "c++", "-E", "-"],
+                input="#define RPYBUILD_PP_CHECK 42\nRPYBUILD_PP_CHECK\n",
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                encoding="utf-8",
+                timeout=60,
+            )
+        except (OSError, subprocess.SubprocessError):
+            continue
+
+        if result.returncode == 0 and "42" in result.stdout:
+            return tuple(args)
+
+    return None
+
+
+def get_preprocessor_backend() -> str:
+    """
+    Returns the preprocessor to use for headers that don't ask for pcpp.
+    This is set by RPYBUILD_PP, which can be 'auto' (the default), 'gcc', or
+    'pcpp'. 'auto' uses gcc if find_native_preprocessor finds a compiler.
+    """
+    backend = os.environ.get("RPYBUILD_PP", "auto")
+    if os.getenv("RPYBUILD_PP_GCC") == "1":
+        # deprecated
+        backend = "gcc"
+
+    if backend == "auto":
+        return "gcc" if find_native_preprocessor() else "pcpp"
+    elif backend not in PREPROCESSOR_BACKENDS:
+        raise ValueError(
+            f"RPYBUILD_PP must be 'auto' or one of {PREPROCESSOR_BACKENDS} (got '{backend}')"
+        )
+    return backend
+
+
+def get_backend_id(backend: str) -> str:
+    """Identifies a backend and its version, used as part of cache keys"""
+    if backend == "gcc":
+        # system headers aren't in the dependencies, so a compiler upgrade
+        # must change the id
+        cmd = find_native_preprocessor() or ("g++",)
+        return "gcc:" + json.dumps(
+            {"cmd": " ".join(cmd), "executables": identify_executables(cmd)},
+            sort_keys=True,
+        )
+    return f"pcpp:{pcpp.__version__}"
+
+
+def make_preprocessor(
+    *,
+    backend: str,
+    defines: typing.List[str],
+    include_paths: typing.List[str],
+    encoding: typing.Optional[str],
+    deps: Dependencies,
+    include_cache: typing.Optional[IncludeCache] = None,
+) -> PreprocessorFunction:
+    if backend == "gcc":
+        return make_gcc_preprocessor(
+            defines=defines,
+            include_paths=include_paths,
+            encoding=encoding,
+            deps=deps,
+            gcc_args=list(find_native_preprocessor() or ["g++"]),
+        )
+    else:
+        return make_pcpp_preprocessor(
+            defines=defines,
+            include_paths=include_paths,
+            encoding=encoding,
+            deps=deps,
+            include_cache=include_cache,
+        )
+
+
+def benchmark_preprocessors(
+    filename: str,
+    *,
+    defines: typing.List[str],
+    include_paths: typing.List[str],
+    encoding: typing.Optional[str],
+) -> typing.Dict[str, typing.Optional[float]]:
+    """
+    Returns the number of seconds that each available backend took to
+    preprocess a header, or None if the backend failed. Caches are not used.
+    """
+    times: typing.Dict[str, typing.Optional[float]] = {}
+    for backend in PREPROCESSOR_BACKENDS:
+        if backend == "gcc" and find_native_preprocessor() is None:
+            continue
+
+        preprocess = make_preprocessor(
+            backend=backend,
+            defines=defines,
+            include_paths=include_paths,
+            encoding=encoding,
+            deps={},
+        )
+
+        start = time.perf_counter()
+        try:
+            preprocess(filename, None)
+        except _backend_errors:
+            times[backend] = None
+        else:
+            times[backend] = time.perf_counter() - start
+
+    return times
+
+
+#
+# Cache of preprocessed output
+#
+
+#: Number of sets of dependencies remembered for each header configuration
+_max_cached_variants = 8
+
+
+def make_cached_preprocessor(
+    *,
+    backend: str,
+    defines: typing.List[str],
+    include_paths: typing.List[str],
+    encoding: typing.Optional[str],
+    deps: Dependencies,
+    cache: typing.Optional[DiskCache],
+    include_cache: typing.Optional[IncludeCache] = None,
+) -> PreprocessorFunction:
+    """
+    Same as make_preprocessor, but reuses previously preprocessed output if
+    the header was preprocessed with the same configuration and none of the
+    files that it included have changed. If a backend other than pcpp fails,
+    the header is preprocessed using pcpp instead.
+
+    The cache has an index entry for each header configuration that lists
+    the dependencies of recently preprocessed variants of the header. The
+    output for each variant is stored under a key that includes the hashes
+    of its dependencies.
+    """
+
+    def _preprocess(backend: str, filename: str, content: typing.Optional[str]) -> str:
+        file_deps: Dependencies = {}
+        preprocess = make_preprocessor(
+            backend=backend,
+            defines=defines,
+            include_paths=include_paths,
+            encoding=encoding,
+            deps=file_deps,
+            include_cache=include_cache,
+        )
+
+        if content is not None or cache is None:
+            result = preprocess(filename, content)
+            deps.update(file_deps)
+            return result
+
+        index_key = compute_key(
+            version=version,
+            preprocessor=get_backend_id(backend),
+            filename=os.path.abspath(filename),
+            defines=defines,
+            include_paths=include_paths,
+            encoding=encoding,
+        )
+
+        index: typing.List[Dependencies] = []
+        data = cache.get(index_key)
+        if data is not None:
+            try:
+                index = json.loads(data)
+            except ValueError:
+                pass
+
+        hasher = FileHasher()
+        for variant in index:
+            if all(hasher.hash(path) == h for path, h in variant.items()):
+                data = cache.get(compute_key(index=index_key, deps=variant))
+                if data is not None:
+                    deps.update(variant)
+                    return data.decode("utf-8")
+
+        result = preprocess(filename, None)
+        deps.update(file_deps)
+
+        cache.put(compute_key(index=index_key, deps=file_deps), result.encode("utf-8"))
+        index = [file_deps] + [v for v in index if v != file_deps]
+        cache.put(index_key, json.dumps(index[:_max_cached_variants]).encode("utf-8"))
+
+        return result
+
+    def _preprocess_file(filename: str, content: typing.Optional[str]) -> str:
+        if backend != "pcpp":
+            try:
+                return _preprocess(backend, filename, content)
+            except _backend_errors as e:
+                print(
+                    f"WARNING: {backend} failed to preprocess {filename}, using pcpp instead ({e})"
+                )
+
+        return _preprocess("pcpp", filename, content)
+
+    return _preprocess_file
@@ -1,33 +1,52 @@
 import argparse
 import sys
+import typing
 
-from .build_dep import BuildDep
-from .create_gen import GenCreator
-from .create_imports import ImportCreator
-from .parse_maven import MavenParser
-from .platform_info import PlatformInfo
-from .show_override import ShowOverrides
-from .scan_headers import HeaderScanner
+from .server import run_on_server
 
 
-def main():
-    parser = argparse.ArgumentParser(prog="robotpy-build")
-    parent_parser = argparse.ArgumentParser(add_help=False)
-    subparsers = parser.add_subparsers(dest="cmd")
-    subparsers.required = True
+def _get_commands():
+    # These are imported here because it is slow, and isn't necessary when
+    # the command is run by the server
+    from .build_dep import BuildDep
+    from .cache import CacheCmd
+    from .create_gen import GenCreator
+    from .create_imports import ImportCreator
+    from .dump_context import ContextDumper
+    from .parse_maven import MavenParser
+    from .platform_info import PlatformInfo
+    from .regen import HeaderRegenerator
+    from .server import GenServer
+    from .show_override import ShowOverrides
+    from .scan_headers import HeaderScanner
+    from .watch import Watcher
 
-    for cls in (
+    return (
         BuildDep,
+        CacheCmd,
+        ContextDumper,
         GenCreator,
+        GenServer,
+        HeaderRegenerator,
         HeaderScanner,
         ImportCreator,
         PlatformInfo,
         ShowOverrides,
         MavenParser,
-    ):
+        Watcher,
+    )
+
+
+def run_command(argv: typing.List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="robotpy-build")
+    parent_parser = argparse.ArgumentParser(add_help=False)
+    subparsers = parser.add_subparsers(dest="cmd")
+    subparsers.required = True
+
+    for cls in _get_commands():
         cls.add_subparser(parent_parser, subparsers).set_defaults(cls=cls)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     cmd = args.cls()
     retval = cmd.run(args)
 
@@ -43,5 +62,13 @@ def main():
     return retval
 
 
+def main():
+    argv = sys.argv[1:]
+    retval = run_on_server(argv)
+    if retval is None:
+        retval = run_command(argv)
+    return retval
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,54 @@
+from os.path import join
+
+from ..diskcache import CACHES, DiskCache, get_cache_root, get_cache_size
+
+
+def _mb(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f}MB"
+
+
+class CacheCmd:
+    @classmethod
+    def add_subparser(cls, parent_parser, subparsers):
+        parser = subparsers.add_parser(
+            "cache",
+            help="Displays or prunes the persistent caches used by robotpy-build",
+            parents=[parent_parser],
+        )
+        parser.add_argument(
+            "action", nargs="?", choices=["info", "prune", "clear"], default="info"
+        )
+        parser.add_argument(
+            "--max-size",
+            type=float,
+            default=None,
+            help="Prune caches to this size in MB instead of their configured size",
+        )
+        parser.add_argument(
+            "--name",
+            choices=sorted(CACHES),
+            action="append",
+            help="Only operate on the specified cache",
+        )
+        return parser
+
+    def run(self, args):
+        root = get_cache_root()
+        print(f"cache directory: {root}")
+
+        for name in args.name or sorted(CACHES):
+            max_size = get_cache_size(name)
+            cache = DiskCache(join(root, name), max_size)
+
+            if args.action == "clear":
+                removed, size = cache.clear()
+                print(f"{name}: removed {removed} entries ({_mb(size)})")
+            elif args.action == "prune":
+                if args.max_size is not None:
+                    max_size = int(args.max_size * 1024 * 1024)
+                removed, size = cache.prune(max(max_size, 0))
+                print(f"{name}: removed {removed} entries ({_mb(size)})")
+            else:
+                count, size = cache.stats()
+                limit = _mb(max_size) if max_size > 0 else "disabled"
+                print(f"{name}: {count} entries, {_mb(size)} (limit: {limit})")
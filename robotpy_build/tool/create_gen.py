@@ -1,9 +1,23 @@
 from os.path import exists
+import typing
 
 from .util import get_setup
 from ..autowrap.generator_data import MissingReporter
 
 
+def _filter_classes(reporter: MissingReporter, classes: typing.List[str]) -> None:
+    for name, report in list(reporter.reports.items()):
+        found = {
+            cls: data
+            for cls, data in report.get("classes", {}).items()
+            if cls in classes
+        }
+        if found:
+            reporter.reports[name] = {"classes": found}
+        else:
+            del reporter.reports[name]
+
+
 class GenCreator:
     @classmethod
     def add_subparser(cls, parent_parser, subparsers):
@@ -16,10 +30,25 @@ class GenCreator:
             "--write", help="Write to files if they don't exist", action="store_true"
         )
         parser.add_argument("--strip-prefixes", action="append")
+        parser.add_argument(
+            "--header",
+            action="append",
+            help="Only process the specified autogen header (name in pyproject.toml)",
+        )
+        parser.add_argument(
+            "--class",
+            dest="classes",
+            action="append",
+            help="Only show the missing data for the specified class",
+        )
 
         return parser
 
     def run(self, args):
+        if args.write and args.classes:
+            print("ERROR: --write cannot be used with --class")
+            return False
+
         pfx = ""
         if args.strip_prefixes:
             pfx = "strip_prefixes:\n- " + "\n- ".join(args.strip_prefixes) + "\n\n"
@@ -27,7 +56,10 @@ class GenCreator:
         s = get_setup()
         for wrapper in s.wrappers:
             reporter = MissingReporter()
-            wrapper.on_build_gen("", reporter)
+            wrapper.on_build_gen("", reporter, headers=args.header)
+
+            if args.classes:
+                _filter_classes(reporter, args.classes)
 
             nada = True
             for name, report in reporter.as_yaml():
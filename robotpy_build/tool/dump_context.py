@@ -0,0 +1,30 @@
+import pprint
+
+from .util import get_setup
+from ..autowrap.generator_data import MissingReporter
+
+
+class ContextDumper:
+    @classmethod
+    def add_subparser(cls, parent_parser, subparsers):
+        parser = subparsers.add_parser(
+            "dump-context",
+            help="Displays the data that a header's wrappers are rendered from",
+            parents=[parent_parser],
+        )
+        parser.add_argument("header", help="Name of the header in pyproject.toml")
+        return parser
+
+    def run(self, args):
+        s = get_setup()
+        for wrapper in s.wrappers:
+            if args.header in (wrapper.cfg.autogen_headers or {}):
+                contexts = {}
+                wrapper.on_build_gen(
+                    "", MissingReporter(), headers=[args.header], contexts=contexts
+                )
+                pprint.pprint(contexts[args.header])
+                return
+
+        print("ERROR: unknown header", args.header)
+        return False
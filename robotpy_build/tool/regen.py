@@ -0,0 +1,35 @@
+from .util import get_build_gen_cmd, get_setup
+
+
+class HeaderRegenerator:
+    @classmethod
+    def add_subparser(cls, parent_parser, subparsers):
+        parser = subparsers.add_parser(
+            "regen",
+            help="Regenerate the wrappers for the specified autogen headers",
+            parents=[parent_parser],
+        )
+        parser.add_argument(
+            "headers", nargs="+", help="Name of the header in pyproject.toml"
+        )
+        return parser
+
+    def run(self, args):
+        s = get_setup()
+        build_gen = get_build_gen_cmd(s)
+
+        remaining = set(args.headers)
+        for wrapper in s.wrappers:
+            headers = remaining.intersection(wrapper.cfg.autogen_headers or {})
+            if headers:
+                remaining -= headers
+                wrapper.on_build_gen(
+                    build_gen.cxx_gen_dir,
+                    jobs=build_gen.jobs,
+                    force=True,
+                    headers=headers,
+                )
+
+        if remaining:
+            print("ERROR: unknown headers:", ", ".join(sorted(remaining)))
+            return False
@@ -0,0 +1,186 @@
+#
+# A resident process that runs robotpy-build commands for a project, so that
+# the project configuration and the modules used to parse headers are only
+# loaded once. When the server is running, the robotpy-build command sends
+# commands to it instead of running them itself.
+#
+# This module is imported before every command is run, so it must be fast
+# to import.
+#
+
+import contextlib
+import hashlib
+import io
+import json
+import os
+from os.path import dirname, exists, join
+import socket
+import sys
+import traceback
+import typing
+
+from ..diskcache import get_cache_root
+
+#: Commands that are run by the server if it is running
+SERVED_COMMANDS = {
+    "create-gen",
+    "dump-context",
+    "regen",
+    "scan-headers",
+    "show-override",
+}
+
+
+def get_server_address(root: str) -> str:
+    """Path of the socket for the server of the project in root"""
+    key = hashlib.sha256(os.path.abspath(root).encode("utf-8")).hexdigest()
+    return join(get_cache_root(), "server", f"{key[:16]}.sock")
+
+
+def _request(
+    address: str, request: typing.Dict[str, typing.Any]
+) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    """Returns None if the server is not running"""
+    if not hasattr(socket, "AF_UNIX") or not exists(address):
+        return None
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(address)
+        except OSError:
+            return None
+
+        with sock.makefile("rwb") as fp:
+            fp.write(json.dumps(request).encode("utf-8") + b"\n")
+            fp.flush()
+            line = fp.readline()
+
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def run_on_server(argv: typing.List[str]) -> typing.Optional[int]:
+    """
+    Runs a command on the server for the project in the current directory.
+    Returns None if the server isn't running, or can't run the command.
+    """
+    if not argv or argv[0] not in SERVED_COMMANDS:
+        return None
+    if os.environ.get("RPYBUILD_NO_SERVER") == "1":
+        return None
+
+    response = _request(get_server_address(os.getcwd()), {"argv": argv})
+    if response is None:
+        return None
+
+    sys.stdout.write(response["output"])
+    return response["retval"]
+
+
+def _run_captured(argv: typing.List[str]) -> typing.Dict[str, typing.Any]:
+    from .__main__ import run_command
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            retval = run_command(argv)
+        except SystemExit as e:
+            # argparse exits on errors and --help
+            retval = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception:
+            traceback.print_exc()
+            retval = 1
+
+    return {"output": output.getvalue(), "retval": retval}
+
+
+class GenServer:
+    @classmethod
+    def add_subparser(cls, parent_parser, subparsers):
+        parser = subparsers.add_parser(
+            "server",
+            help="Runs commands for the project in the current directory quickly",
+            parents=[parent_parser],
+        )
+        parser.add_argument(
+            "action", nargs="?", choices=["start", "stop", "status"], default="start"
+        )
+        return parser
+
+    def run(self, args):
+        if not hasattr(socket, "AF_UNIX"):
+            print("ERROR: the server requires unix domain socket support")
+            return False
+
+        address = get_server_address(os.getcwd())
+
+        if args.action == "status":
+            running = _request(address, {"ping": True}) is not None
+            print(f"server is {'running' if running else 'not running'} ({address})")
+            return running
+
+        if args.action == "stop":
+            if _request(address, {"stop": True}) is None:
+                print("server is not running")
+                return False
+            print("server stopped")
+            return True
+
+        if _request(address, {"ping": True}) is not None:
+            print("ERROR: server is already running")
+            return False
+
+        return self._serve(address)
+
+    def _serve(self, address: str) -> bool:
+        import socketserver
+
+        from .util import enable_setup_reuse
+
+        enable_setup_reuse()
+
+        running = True
+
+        class _Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                nonlocal running
+
+                request = json.loads(self.rfile.readline())
+                response: typing.Dict[str, typing.Any] = {}
+                if "argv" in request:
+                    argv = request["argv"]
+                    if (
+                        not isinstance(argv, list)
+                        or not argv
+                        or argv[0] not in SERVED_COMMANDS
+                    ):
+                        print("rejected:", argv)
+                        response = {
+                            "output": f"ERROR: the server does not run {argv!r}\n",
+                            "retval": 1,
+                        }
+                    else:
+                        print("running:", *argv)
+                        response = _run_captured(argv)
+                elif request.get("stop"):
+                    running = False
+
+                self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+        # remove the socket of a server that didn't exit cleanly
+        os.makedirs(dirname(address), exist_ok=True)
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(address)
+
+        with socketserver.UnixStreamServer(address, _Handler) as server:
+            print(f"serving {os.getcwd()} at {address} (press CTRL-C to exit)")
+            try:
+                while running:
+                    server.handle_request()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.unlink(address)
+
+        return True
@@ -1,7 +1,51 @@
+import os
+from os.path import join
+import typing
+
 from ..setup import Setup
 
+#: When enabled, get_setup returns the same Setup until pyproject.toml is
+#: modified. Used by the generation server.
+_reuse_setup = False
+_setup_cache: typing.Optional[typing.Tuple[typing.Any, Setup]] = None
+
+
+def enable_setup_reuse() -> None:
+    global _reuse_setup
+    _reuse_setup = True
+
 
 def get_setup() -> Setup:
+    global _setup_cache
+
+    key = None
+    if _reuse_setup:
+        root = os.getcwd()
+        try:
+            key = (root, os.stat(join(root, "pyproject.toml")).st_mtime_ns)
+        except OSError:
+            pass
+        else:
+            if _setup_cache is not None and _setup_cache[0] == key:
+                return _setup_cache[1]
+
     s = Setup()
     s.prepare()
+
+    if key is not None:
+        _setup_cache = (key, s)
+
     return s
+
+
+def get_build_gen_cmd(s: Setup):
+    """
+    Returns the finalized build_gen command for the project, which has the
+    same options that ``setup.py build_gen`` would use
+    """
+    from setuptools.dist import Distribution
+
+    dist = Distribution(s.setup_kwargs)
+    cmd = dist.get_command_obj("build_gen")
+    cmd.ensure_finalized()
+    return cmd
@@ -0,0 +1,149 @@
+import os
+from os.path import join
+import subprocess
+import sys
+import time
+import traceback
+import typing
+
+from .util import get_build_gen_cmd, get_setup
+from ..setup import Setup
+
+Snapshot = typing.Dict[str, typing.Optional[typing.Tuple[int, int]]]
+
+
+def _snapshot(fnames: typing.Iterable[str]) -> Snapshot:
+    snapshot: Snapshot = {}
+    for fname in fnames:
+        try:
+            st = os.stat(fname)
+        except OSError:
+            snapshot[fname] = None
+        else:
+            snapshot[fname] = (st.st_mtime_ns, st.st_size)
+    return snapshot
+
+
+class Watcher:
+    """
+    Keeps the project configuration loaded and regenerates the wrappers
+    whenever one of the files used to generate them is modified. Only the
+    headers affected by a change are regenerated.
+    """
+
+    @classmethod
+    def add_subparser(cls, parent_parser, subparsers):
+        parser = subparsers.add_parser(
+            "watch",
+            help="Regenerate wrappers when their headers or generation data change",
+            parents=[parent_parser],
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0.25,
+            help="Seconds to wait between checking for modified files",
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=None,
+            help="Number of processes to use when generating files",
+        )
+        parser.add_argument(
+            "--build",
+            action="store_true",
+            help="Compile modified sources after regenerating (build_ext --inplace)",
+        )
+        return parser
+
+    def run(self, args):
+        self.jobs = args.jobs
+        self._load()
+        self._generate()
+
+        inputs = self._get_inputs()
+        snapshot = _snapshot(inputs)
+        print(f"watching {len(inputs)} files for changes (press CTRL-C to exit)")
+
+        try:
+            while True:
+                time.sleep(args.interval)
+                if _snapshot(snapshot) == snapshot:
+                    continue
+
+                # give editors a chance to finish writing before reading
+                time.sleep(args.interval)
+                current = _snapshot(snapshot)
+                changed = sorted(f for f, st in current.items() if snapshot[f] != st)
+                for fname in changed:
+                    print("modified:", fname)
+
+                if self.pyproject in changed:
+                    print("pyproject.toml modified, reloading project")
+                    self._load()
+
+                files_changed = self.setup.wwriter.files_changed
+                if self._generate() and args.build:
+                    if self.setup.wwriter.files_changed != files_changed:
+                        self._build()
+
+                inputs = self._get_inputs(inputs)
+                snapshot = _snapshot(inputs)
+        except KeyboardInterrupt:
+            pass
+
+    def _load(self):
+        try:
+            setup = get_setup()
+            build_gen = get_build_gen_cmd(setup)
+            build_gen.run_command("build_dl")
+        except Exception:
+            if not hasattr(self, "setup"):
+                raise
+            traceback.print_exc()
+            print("WARNING: could not reload project, using previous configuration")
+            return
+
+        self.setup: Setup = setup
+        self.pyproject = join(setup.root, "pyproject.toml")
+        self.cxx_gen_dir = build_gen.cxx_gen_dir
+        if self.jobs is None:
+            self.jobs = build_gen.jobs
+
+    def _get_inputs(
+        self, previous: typing.Optional[typing.Set[str]] = None
+    ) -> typing.Set[str]:
+        inputs = {self.pyproject}
+        try:
+            for wrapper in self.setup.wrappers:
+                inputs.update(wrapper.get_gen_inputs(self.cxx_gen_dir))
+        except Exception:
+            if previous is None:
+                raise
+            traceback.print_exc()
+            return previous
+        return inputs
+
+    def _generate(self) -> bool:
+        start = time.perf_counter()
+        try:
+            for wrapper in self.setup.wrappers:
+                wrapper.on_build_gen(self.cxx_gen_dir, jobs=self.jobs)
+        except Exception:
+            traceback.print_exc()
+            print("ERROR: generation failed, waiting for changes")
+            return False
+
+        print(f"generation completed in {time.perf_counter() - start:.2f}s")
+        return True
+
+    def _build(self):
+        args = [sys.executable, "setup.py", "build_ext", "--inplace"]
+        print("+", *args)
+        # only recompile the objects affected by the regenerated files
+        env = dict(os.environ, RPYBUILD_INCREMENTAL="1")
+        retval = subprocess.call(args, cwd=self.setup.root, env=env)
+        if retval != 0:
+            print(f"ERROR: build failed with exit code {retval}")
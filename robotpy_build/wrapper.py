@@ -1,3 +1,5 @@
+import concurrent.futures
+import cProfile
 import glob
 import json
 import inspect
@@ -16,40 +18,363 @@ from os.path import (
 )
 import pathlib
 import posixpath
+import pstats
 import shutil
 import sysconfig
+import time
 import toposort
-from typing import Any, Dict, List, Optional, Set, Tuple
+from typing import Any, Collection, Dict, Iterator, List, Optional, Set, Tuple
 
 from urllib.error import HTTPError
 import dataclasses
 
 from setuptools import Extension
 
+import cxxheaderparser
 from cxxheaderparser.options import ParserOptions
-from cxxheaderparser import preprocessor
+import sphinxify
 
 
 from .download import download_and_extract_zip
 from .config.pyproject_toml import PatchInfo, WrapperConfig, Download
 
+from .autowrap import context as autowrap_context
+from .autowrap import cxxparser as autowrap_cxxparser
+from .autowrap import generator_data as autowrap_generator_data
+from .autowrap.context import HeaderContext
+from .autowrap.timing import PHASES, PhaseTimer
 from .autowrap.cxxparser import parse_header
 from .autowrap.generator_data import GeneratorData, MissingReporter
 from .autowrap.writer import WrapperWriter
+from .gencache import (
+    FileHasher,
+    GenerationManifest,
+    compute_key,
+    depfile_is_current,
+    format_depfile,
+    hash_modules,
+    load_depfile,
+    read_depfile,
+)
+from .diskcache import DiskCache, get_cache
+from .preprocessor import (
+    Dependencies,
+    IncludeCache,
+    benchmark_preprocessors,
+    get_backend_id,
+    get_preprocessor_backend,
+    make_cached_preprocessor,
+)
+from .version import version
 
+from .config import autowrap_yml, util as config_util
 from .config.autowrap_yml import AutowrapConfigYaml
 from .config.dev_yml import get_dev_config
 from .config.pyproject_toml import WrapperConfig, Download
 
-# TODO: eventually provide native preprocessor by default and allow it
-#       to be enabled/disabled per-file just in case
-if os.getenv("RPYBUILD_PP_GCC") == "1":
-    # GCC preprocessor can be 10x faster than pcpp for very complex files
-    def make_preprocessor(*args, **kwargs):
-        return preprocessor.make_gcc_preprocessor(print_cmd=False, *args, **kwargs)
 
-else:
-    make_preprocessor = preprocessor.make_pcpp_preprocessor
+@dataclasses.dataclass
+class HeaderGenJob:
+    """
+    Everything needed to generate the wrapper for a single header. This is
+    passed to worker processes when generating in parallel, so it must be
+    picklable.
+    """
+
+    #: name of the header in pyproject.toml
+    name: str
+    #: header as specified in pyproject.toml
+    header: str
+    header_path: str
+    header_root: str
+
+    #: generation data, or None if it must be loaded from data_path
+    data: Optional[AutowrapConfigYaml]
+    data_path: Optional[str]
+    #: name used when reporting missing data
+    data_fname: Optional[str]
+
+    pp_defines: List[str]
+    pp_includes: List[str]
+    #: preprocessor to use, unless the generation data asks for pcpp
+    pp_backend: str
+    #: cache of preprocessed output
+    pp_cache: Optional[DiskCache]
+    #: if True, time each preprocessor backend on the header
+    pp_benchmark: bool
+    casters: Dict[str, Dict[str, Any]]
+
+    #: cache of parsed headers, and the key for this header's parser inputs
+    #: (not including the files that the header includes)
+    hctx_cache: Optional[DiskCache]
+    hctx_key: Optional[str]
+    #: cache of converted doxygen comments
+    doc_cache: Optional[DiskCache]
+
+    report_only: bool
+    cxx_gen_dir: str
+    hppoutdir: str
+    classdeps_dst: Optional[str]
+    #: records the files included by the header
+    depfile: Optional[str]
+    #: if set, the header is profiled and the results written to this file
+    profile_fname: Optional[str]
+    #: if True, the HeaderContext is included in the result
+    return_hctx: bool
+    #: if True, sources are generated so that they can be compiled together
+    unity: bool
+
+    wwriter: WrapperWriter
+
+
+@dataclasses.dataclass
+class HeaderGenResult:
+    generated_sources: List[str]
+    #: MissingReporter reports, keyed by generation data filename
+    missing_reports: Dict[str, Any]
+    #: All files written
+    outputs: List[str]
+    #: Headers included by the generated sources for type casters
+    type_caster_includes: List[str]
+    #: False if the generated sources must not be combined with the sources
+    #: of other headers in a unity build
+    unity: bool
+
+    #: Counts of files written/changed by the writer
+    files_written: int = 0
+    files_changed: int = 0
+
+    #: Seconds that each preprocessor took (None if it failed), if benchmarking
+    pp_times: Optional[Dict[str, Optional[float]]] = None
+
+    #: PhaseTimer.phases for the header
+    timings: Optional[Dict[str, Dict[str, float]]] = None
+
+    #: The parsed header, if HeaderGenJob.return_hctx was set
+    hctx: Optional[HeaderContext] = None
+
+
+def _get_parser_id() -> str:
+    # Identifies the code that produces a HeaderContext. The code that renders
+    # it is deliberately not included so that parsed headers can be reused
+    # when only the rendering changes
+    return compute_key(
+        modules=hash_modules(
+            [
+                autowrap_context,
+                autowrap_cxxparser,
+                autowrap_generator_data,
+                autowrap_yml,
+                config_util,
+            ]
+        ),
+        cxxheaderparser=cxxheaderparser.__version__,
+        sphinxify=sphinxify.__version__,
+    )
+
+
+def _load_parsed_header(
+    job: HeaderGenJob,
+) -> Optional[Tuple[HeaderContext, Dict[str, Any], Dependencies]]:
+    # The result of parsing a header can be reused if the inputs to the
+    # parser and the files the header includes haven't changed
+    if job.hctx_cache is None or job.hctx_key is None or job.depfile is None:
+        return None
+
+    deps = read_depfile(job.depfile, FileHasher())
+    if deps is None:
+        return None
+
+    cached = job.hctx_cache.get_pickle(compute_key(hctx=job.hctx_key, deps=deps))
+    if cached is None:
+        return None
+
+    hctx, missing_reports = cached
+    return hctx, missing_reports, deps
+
+
+def generate_header(job: HeaderGenJob) -> HeaderGenResult:
+    """
+    Parses a single header and writes the generated files for it
+    """
+    if job.profile_fname is None:
+        return _generate_header(job)
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(_generate_header, job)
+    finally:
+        profiler.dump_stats(job.profile_fname)
+
+
+def _generate_header(job: HeaderGenJob) -> HeaderGenResult:
+    pp_times = None
+    timer = PhaseTimer()
+    with timer.phase("load"):
+        parsed = _load_parsed_header(job)
+
+    generated_sources: List[str] = []
+    outputs: List[str] = []
+    type_caster_includes: List[str] = []
+    unity = False
+
+    wwriter = job.wwriter
+    files_written = wwriter.files_written
+    files_changed = wwriter.files_changed
+
+    try:
+        if parsed is not None:
+            hctx, missing_reports, deps = parsed
+        else:
+            data = job.data
+            if data is None:
+                with timer.phase("load"):
+                    data = AutowrapConfigYaml.from_file(job.data_path)
+
+            pp_backend = job.pp_backend
+            if not data.native_preprocessor:
+                pp_backend = "pcpp"
+
+            if job.pp_benchmark:
+                pp_times = benchmark_preprocessors(
+                    job.header_path,
+                    defines=job.pp_defines,
+                    include_paths=job.pp_includes,
+                    encoding=data.encoding,
+                )
+
+            deps = {}
+            popts = ParserOptions(
+                preprocessor=make_cached_preprocessor(
+                    backend=pp_backend,
+                    defines=job.pp_defines,
+                    include_paths=job.pp_includes,
+                    encoding=data.encoding,
+                    deps=deps,
+                    cache=job.pp_cache,
+                    include_cache=_include_cache,
+                )
+            )
+
+            gendata = GeneratorData(data)
+            hctx = parse_header(
+                job.name,
+                pathlib.Path(job.header_path),
+                pathlib.Path(job.header_root),
+                gendata,
+                popts,
+                job.casters,
+                job.report_only,
+                timer,
+                job.doc_cache,
+            )
+
+            missing_reporter = MissingReporter()
+            gendata.report_missing(job.data_fname, missing_reporter)
+            missing_reports = missing_reporter.reports
+
+            if job.hctx_cache is not None and job.hctx_key is not None:
+                with timer.phase("write"):
+                    job.hctx_cache.put_pickle(
+                        compute_key(hctx=job.hctx_key, deps=deps),
+                        (hctx, missing_reports),
+                    )
+
+        if not job.report_only:
+            unity = job.unity and hctx.unity
+            generated_sources = wwriter.write_files(
+                hctx,
+                job.name,
+                job.cxx_gen_dir,
+                job.hppoutdir,
+                job.classdeps_dst,
+                outputs,
+                timer,
+                unity,
+            )
+            type_caster_includes = hctx.type_caster_includes
+
+        # The parsed header is often the largest object alive during
+        # generation, so release it as soon as its outputs are written
+        result_hctx = hctx if job.return_hctx else None
+        del hctx, parsed
+
+        if not job.report_only:
+            assert job.depfile is not None
+            with timer.phase("write"):
+                outputs.append(job.depfile)
+                wwriter.write_file(job.depfile, format_depfile(deps))
+    except Exception as e:
+        raise ValueError(f"processing {job.header}") from e
+
+    return HeaderGenResult(
+        generated_sources,
+        missing_reports,
+        outputs,
+        type_caster_includes,
+        unity,
+        wwriter.files_written - files_written,
+        wwriter.files_changed - files_changed,
+        pp_times,
+        timer.phases,
+        result_hctx,
+    )
+
+
+def get_gen_parallel_jobs() -> int:
+    """
+    Number of processes to use for generation when it isn't specified
+    by the user. Uses the same convention as RPYBUILD_PARALLEL.
+    """
+    parallel = int(os.environ.get("RPYBUILD_GEN_PARALLEL", "0"))
+    if parallel == 1:
+        return os.cpu_count() or 1
+    return max(parallel, 1)
+
+
+def get_unity_size() -> int:
+    """
+    Maximum size of the files that small generated sources are combined
+    into, or 0 if sources aren't combined (the default)
+    """
+    if os.environ.get("RPYBUILD_UNITY") != "1":
+        return 0
+    return int(os.environ.get("RPYBUILD_UNITY_SIZE", "128")) * 1024
+
+
+#: Shared by all headers generated by a process during a single build_gen
+_include_cache: Optional[IncludeCache] = None
+
+
+def _init_include_cache() -> None:
+    global _include_cache
+    _include_cache = IncludeCache()
+
+
+def _run_header_gen_jobs(
+    gen_jobs: List[HeaderGenJob], jobs: int
+) -> Iterator[HeaderGenResult]:
+    # Results are always yielded in the order the jobs were given, so the
+    # output of a parallel run is identical to that of a serial run
+    global _include_cache
+
+    if jobs <= 1 or len(gen_jobs) <= 1:
+        _init_include_cache()
+        try:
+            yield from map(generate_header, gen_jobs)
+        finally:
+            _include_cache = None
+    else:
+        jobs = min(jobs, len(gen_jobs))
+        with concurrent.futures.ProcessPoolExecutor(
+            jobs, initializer=_init_include_cache
+        ) as executor:
+            results = executor.map(generate_header, gen_jobs)
+            for job, result in zip(gen_jobs, results):
+                # the worker wrote using a copy of the writer
+                job.wwriter.files_written += result.files_written
+                job.wwriter.files_changed += result.files_changed
+                yield result
 
 
 class Wrapper:
@@ -105,6 +430,9 @@ class Wrapper:
         self._all_deps = None
 
         self._gen_includes = []
+        self._gen_sources: List[str] = []
+        # type caster headers included by the generated sources of each header
+        self._gen_caster_includes: Dict[str, List[str]] = {}
 
         self.extension = None
         if self.cfg.sources or self.cfg.autogen_headers:
@@ -298,6 +626,19 @@ class Wrapper:
     def _generation_search_path(self):
         return [self.root] + self._all_includes(False)
 
+    def _find_autogen_header(
+        self, header: str, generation_search_path: List[str]
+    ) -> Tuple[str, str]:
+        for path in generation_search_path:
+            header_path = join(path, header)
+            if exists(header_path):
+                return path, header_path
+
+        import pprint
+
+        pprint.pprint(generation_search_path)
+        raise ValueError("could not find " + header)
+
     def _all_library_dirs(self):
         libs = self.get_library_dirs()
         for dep in self.cfg.depends:
@@ -353,16 +694,6 @@ class Wrapper:
         pkgcfgpy = join(self.root, "pkgcfg.py")
         srcdir = join(srcdir, self.name)
 
-        try:
-            os.unlink(self.libinit_import_py)
-        except OSError:
-            pass
-
-        try:
-            os.unlink(pkgcfgpy)
-        except OSError:
-            pass
-
         libnames_full = []
         all_libs = []
         downloads = self.cfg.download
@@ -524,8 +855,7 @@ class Wrapper:
 
         init = init.replace("##IMPORTS##", imports)
 
-        with open(self.libinit_import_py, "w") as fp:
-            fp.write(init)
+        self.wwriter.write_file(self.libinit_import_py, init)
 
         self._add_addl_data_file(self.libinit_import_py)
 
@@ -604,17 +934,67 @@ class Wrapper:
             """
             )
 
-        with open(fname, "w") as fp:
-            fp.write(pkgcfg)
+        self.wwriter.write_file(fname, pkgcfg)
 
         self._add_addl_data_file(fname)
 
+    def get_gen_inputs(self, cxx_gen_dir: str) -> Set[str]:
+        """
+        Returns the files that on_build_gen reads: the autogen headers, the
+        generation data, and everything the headers included the last time
+        that they were generated
+        """
+        if not self.cfg.autogen_headers:
+            return set()
+
+        cxx_gen_dir = join(cxx_gen_dir, self.name)
+        inputs: Set[str] = set()
+
+        datapath = None
+        if self.cfg.generation_data:
+            datapath = join(self.setup_root, normpath(self.cfg.generation_data))
+            if not isdir(datapath):
+                inputs.add(datapath)
+                datapath = None
+
+        generation_search_path = self._generation_search_path()
+
+        for name, header in self.cfg.autogen_headers.items():
+            _, header_path = self._find_autogen_header(
+                normpath(header), generation_search_path
+            )
+            inputs.add(header_path)
+
+            # per-header data is watched even if it doesn't exist yet
+            if datapath is not None:
+                inputs.add(join(datapath, name + ".yml"))
+
+            deps = load_depfile(join(cxx_gen_dir, f"{name}.deps.json"))
+            if deps:
+                inputs.update(deps)
+
+        return inputs
+
     def on_build_gen(
-        self, cxx_gen_dir, missing_reporter: Optional[MissingReporter] = None
+        self,
+        cxx_gen_dir,
+        missing_reporter: Optional[MissingReporter] = None,
+        jobs: int = 1,
+        force: bool = False,
+        headers: Optional[Collection[str]] = None,
+        contexts: Optional[Dict[str, HeaderContext]] = None,
     ):
+        """
+        Generates the wrappers for the autogen headers
+
+        :param headers: only process these headers
+        :param contexts: if specified, the parsed HeaderContext of each header
+                         that is processed is stored here
+        """
         if not self.cfg.autogen_headers:
             return
 
+        start = time.perf_counter()
         cxx_gen_dir = join(cxx_gen_dir, self.name)
 
         if missing_reporter:
@@ -626,11 +1006,30 @@ class Wrapper:
         hppoutdir = join(self.rpy_incdir, "rpygen")
 
         pp_includes = self._all_includes(True) + [sysconfig.get_path("include")]
-
-        # TODO: only regenerate files if the generated files
-        #       have changed
+        pp_backend = get_preprocessor_backend()
+        pp_cache = get_cache("preprocessed")
+        pp_benchmark = os.getenv("RPYBUILD_PP_BENCHMARK") == "1"
+        unity_size = get_unity_size()
+        hctx_cache = None if report_only else get_cache("parsed")
+        doc_cache = get_cache("docs")
+
+        # Profiles should show all of the work needed to generate a header
+        profile_dir = None
+        if self.dev_config.profile_dir:
+            profile_dir = abspath(join(self.dev_config.profile_dir, self.name))
+            os.makedirs(profile_dir, exist_ok=True)
+            pp_cache = None
+            hctx_cache = None
+            doc_cache = None
+
+        # Headers are only regenerated if their inputs have changed since
+        # the last time they were generated
+        manifest: Optional[GenerationManifest] = None
         if not report_only:
-            if self.dev_config.only_generate is None:
+            manifest = GenerationManifest(join(cxx_gen_dir, "rpygen_manifest.json"))
+
+            # Without a manifest we don't know which files are stale
+            if not manifest.entries and self.dev_config.only_generate is None:
                 shutil.rmtree(cxx_gen_dir, ignore_errors=True)
                 shutil.rmtree(hppoutdir, ignore_errors=True)
 
@@ -639,11 +1038,14 @@ class Wrapper:
 
         per_header = False
         data_fname = self.cfg.generation_data
+        data: Optional[AutowrapConfigYaml] = None
+        data_key_path: Optional[str] = None
         if self.cfg.generation_data:
             datapath = join(self.setup_root, normpath(self.cfg.generation_data))
             per_header = isdir(datapath)
             if not per_header:
                 data = AutowrapConfigYaml.from_file(datapath)
+                data_key_path = datapath
         else:
             data = AutowrapConfigYaml()
 
@@ -660,66 +1062,220 @@ class Wrapper:
 
         generation_search_path = self._generation_search_path()
 
+        gen_jobs: List[HeaderGenJob] = []
+        gen_keys: List[str] = []
+
+        hasher = FileHasher()
+        common_key = dict(
+            version=version,
+            pp_defines=pp_defines,
+            pp_includes=pp_includes,
+            casters=casters,
+            preprocessor=get_backend_id(pp_backend),
+            j2_debug=os.getenv("RPYBUILD_J2_DEBUG"),
+            unity=unity_size > 0,
+        )
+
+        # inputs to parsing only
+        parser_key = dict(
+            parser=_get_parser_id(),
+            pp_defines=pp_defines,
+            pp_includes=pp_includes,
+            casters=casters,
+            preprocessor=get_backend_id(pp_backend),
+        )
+
         for name, header in self.cfg.autogen_headers.items():
             header = normpath(header)
-            for path in generation_search_path:
-                header_path = join(path, header)
-                if exists(header_path):
-                    header_root = pathlib.Path(path)
-                    break
-            else:
-                import pprint
-
-                pprint.pprint(generation_search_path)
-                raise ValueError("could not find " + header)
+            header_root, header_path = self._find_autogen_header(
+                header, generation_search_path
+            )
 
+            classdeps_dst = None
+            depfile = None
             if not report_only:
                 classdeps_dst = join(cxx_gen_dir, f"{name}.json")
                 classdeps[name] = classdeps_dst
+                depfile = join(cxx_gen_dir, f"{name}.deps.json")
+
+            if headers is not None and name not in headers:
+                continue
 
+            data_path = None
             if per_header:
                 data_fname = join(datapath, name + ".yml")
                 if not exists(data_fname):
                     print("WARNING: could not find", data_fname)
                     data = AutowrapConfigYaml()
                 else:
-                    data = AutowrapConfigYaml.from_file(data_fname)
+                    # loaded by whoever processes the header
+                    data = None
+                    data_path = data_fname
+                data_key_path = data_path
 
             if only_generate is not None and not only_generate.pop(name, False):
                 continue
 
-            popts = ParserOptions(
-                preprocessor=make_preprocessor(
-                    defines=pp_defines,
-                    include_paths=pp_includes,
-                    encoding=data.encoding,
+            header_key = dict(
+                name=name,
+                header_path=header_path,
+                header_root=header_root,
+                data=hasher.hash(data_key_path) if data_key_path else None,
+            )
+
+            hctx_key = None
+            if hctx_cache is not None:
+                hctx_key = compute_key(common=parser_key, **header_key)
+
+            gen_jobs.append(
+                HeaderGenJob(
+                    name=name,
+                    header=header,
+                    header_path=header_path,
+                    header_root=header_root,
+                    data=data,
+                    data_path=data_path,
+                    data_fname=data_fname,
+                    pp_defines=pp_defines,
+                    pp_includes=pp_includes,
+                    pp_backend=pp_backend,
+                    pp_cache=pp_cache,
+                    pp_benchmark=pp_benchmark,
+                    hctx_cache=hctx_cache,
+                    hctx_key=hctx_key,
+                    doc_cache=doc_cache,
+                    casters=casters,
+                    report_only=report_only,
+                    cxx_gen_dir=cxx_gen_dir,
+                    hppoutdir=hppoutdir,
+                    classdeps_dst=classdeps_dst,
+                    depfile=depfile,
+                    profile_fname=(
+                        join(profile_dir, f"{name}.prof") if profile_dir else None
+                    ),
+                    return_hctx=contexts is not None,
+                    unity=unity_size > 0,
+                    wwriter=self.wwriter,
                 )
             )
 
-            gendata = GeneratorData(data)
+            if manifest is not None:
+                gen_keys.append(compute_key(common=common_key, **header_key))
+
+        # Reuse the results of headers that are up to date: the configuration
+        # must be the same, and the files the header included (as recorded
+        # in its depfile) must not have changed
+        results: List[Optional[HeaderGenResult]] = [None] * len(gen_jobs)
+        to_run: List[int] = []
+        for i, job in enumerate(gen_jobs):
+            entry = None
+            if manifest is not None and not force:
+                entry = manifest.get(job.name, gen_keys[i])
+                if entry is not None:
+                    assert job.depfile is not None
+                    if not depfile_is_current(job.depfile, hasher):
+                        entry = None
+            if entry is None or contexts is not None:
+                to_run.append(i)
+            else:
+                results[i] = HeaderGenResult(
+                    entry["generated_sources"],
+                    entry["missing_reports"],
+                    entry["outputs"],
+                    entry["type_caster_includes"],
+                    entry["unity"],
+                )
 
-            try:
-                hctx = parse_header(
-                    name,
-                    pathlib.Path(header_path),
-                    header_root,
-                    gendata,
-                    popts,
-                    casters,
-                    report_only,
+        if manifest is not None:
+            print(
+                f"{self.name}: generating {len(to_run)} of {len(gen_jobs)} headers",
+                f"({len(gen_jobs) - len(to_run)} up to date)",
+            )
+
+        files_written = self.wwriter.files_written
+        files_changed = self.wwriter.files_changed
+
+        run_results = _run_header_gen_jobs([gen_jobs[i] for i in to_run], jobs)
+        for i, result in zip(to_run, run_results):
+            results[i] = result
+            if contexts is not None:
+                assert result.hctx is not None
+                contexts[gen_jobs[i].name] = result.hctx
+            if manifest is not None:
+                manifest.update(
+                    gen_jobs[i].name,
+                    gen_keys[i],
+                    result.outputs,
+                    result.generated_sources,
+                    result.missing_reports,
+                    result.type_caster_includes,
+                    result.unity,
                 )
 
-                if not report_only:
-                    generated_sources = self.wwriter.write_files(
-                        hctx, name, cxx_gen_dir, hppoutdir, classdeps_dst
-                    )
-                    self.extension.sources.extend(
-                        [relpath(src, self.setup_root) for src in generated_sources]
-                    )
-            except Exception as e:
-                raise ValueError(f"processing {header}") from e
+        if to_run:
+            for cache in (pp_cache, hctx_cache, doc_cache, get_cache("gendata")):
+                if cache is not None:
+                    cache.prune()
+
+        if pp_benchmark:
+            self._print_pp_benchmark(gen_jobs, results)
+
+        if profile_dir and to_run:
+            profiles = [gen_jobs[i].profile_fname for i in to_run]
+            stats = pstats.Stats(*profiles)
+            stats.dump_stats(join(profile_dir, "all.prof"))
+            print(f"{self.name}: wrote {len(profiles)} profiles to {profile_dir}")
+
+        if not report_only and to_run:
+            self._write_timings(
+                join(cxx_gen_dir, "rpygen_timings.json"),
+                time.perf_counter() - start,
+                jobs,
+                [gen_jobs[i] for i in to_run],
+                [results[i] for i in to_run],
+            )
+
+        if manifest is not None:
+            if self.dev_config.only_generate is None and headers is None:
+                manifest.remove_stale(self.cfg.autogen_headers.keys())
+            manifest.save()
+
+        generated_sources: List[str] = []
+        separate_sources: Set[str] = set()
+        caster_includes: Dict[str, List[str]] = {}
+        for job, result in zip(gen_jobs, results):
+            assert result is not None
+            generated_sources.extend(result.generated_sources)
+            if not result.unity:
+                separate_sources.update(result.generated_sources)
+            if result.generated_sources:
+                caster_includes[job.name] = result.type_caster_includes
+            for report_name, report in result.missing_reports.items():
+                missing_reporter.add_report(report_name, report)
+
+        # Only combine sources when all of them are known
+        if unity_size and manifest is not None and headers is None:
+            generated_sources = self.wwriter.write_unity_files(
+                cxx_gen_dir, generated_sources, unity_size, separate_sources
+            )
+
+        # on_build_gen may be called more than once (robotpy-build watch)
+        if headers is None:
+            gen_sources = {relpath(src, self.setup_root) for src in generated_sources}
+            for src in self._gen_sources:
+                if src not in gen_sources and src in self.extension.sources:
+                    self.extension.sources.remove(src)
+            self._gen_sources = []
+            self._gen_caster_includes = caster_includes
+        else:
+            self._gen_caster_includes.update(caster_includes)
 
-            gendata.report_missing(data_fname, missing_reporter)
+        for src in generated_sources:
+            src = relpath(src, self.setup_root)
+            if src not in self.extension.sources:
+                self.extension.sources.append(src)
+            if src not in self._gen_sources:
+                self._gen_sources.append(src)
 
         if only_generate:
             unused = ", ".join(sorted(only_generate))
@@ -735,6 +1291,10 @@ class Wrapper:
         if not report_only:
             self._write_wrapper_hpp(cxx_gen_dir, classdeps)
             gen_includes = [cxx_gen_dir]
+
+            files_written = self.wwriter.files_written - files_written
+            files_changed = self.wwriter.files_changed - files_changed
+            print(f"{self.name}: {files_changed} of {files_written} files changed")
         else:
             gen_includes = []
 
@@ -743,6 +1303,91 @@ class Wrapper:
         for f in glob.glob(join(glob.escape(hppoutdir), "*.hpp")):
             self._add_addl_data_file(f)
 
+    def _write_timings(
+        self,
+        fname: str,
+        elapsed: float,
+        jobs: int,
+        gen_jobs: List[HeaderGenJob],
+        results: List[Optional[HeaderGenResult]],
+    ):
+        # Writes a JSON report of how long each phase of generating each
+        # header took, and prints a summary of the slowest headers
+        headers: Dict[str, Dict[str, Any]] = {}
+        phases: Dict[str, Dict[str, float]] = {}
+
+        for job, result in zip(gen_jobs, results):
+            if result is None or result.timings is None:
+                continue
+
+            headers[job.name] = {
+                "total": sum(p["time"] for p in result.timings.values()),
+                "phases": result.timings,
+            }
+
+            for phase, entry in result.timings.items():
+                total = phases.setdefault(phase, {"time": 0.0})
+                total["time"] += entry["time"]
+                for key in ("peak_rss", "peak_rss_increase"):
+                    if key in entry:
+                        total[key] = max(total.get(key, 0), entry[key])
+
+        report = {
+            "wrapper": self.name,
+            "total": elapsed,
+            "jobs": jobs,
+            "phases": phases,
+            "headers": headers,
+        }
+
+        with open(fname, "w", encoding="utf-8") as fp:
+            json.dump(report, fp, indent=1)
+
+        top_n = int(os.environ.get("RPYBUILD_GEN_TIMINGS_TOP", "5"))
+        if top_n <= 0 or not headers:
+            return
+
+        slowest = sorted(headers.items(), key=lambda h: h[1]["total"], reverse=True)
+        width = max(len(name) for name, _ in slowest[:top_n])
+        width = max(width, len("header"))
+
+        print(f"{self.name}: generated in {elapsed:.2f}s, slowest headers (seconds):")
+        print(f"  {'header':<{width}} {'total':>8}", *(f"{p:>10}" for p in PHASES))
+        for name, h in slowest[:top_n]:
+            cols = [f"{h['phases'].get(p, {}).get('time', 0):10.3f}" for p in PHASES]
+            print(f"  {name:<{width}} {h['total']:8.3f}", *cols)
+
+    def _print_pp_benchmark(
+        self,
+        gen_jobs: List[HeaderGenJob],
+        results: List[Optional[HeaderGenResult]],
+    ):
+        backends = sorted({b for r in results if r and r.pp_times for b in r.pp_times})
+        rows = [
+            (job.name, result.pp_times)
+            for job, result in zip(gen_jobs, results)
+            if result and result.pp_times is not None
+        ]
+        if not rows:
+            return
+
+        width = max(len(name) for name, _ in rows)
+        totals = {b: 0.0 for b in backends}
+
+        print(f"{self.name}: preprocessor benchmark (seconds)")
+        print(f"  {'header':<{width}}", *(f"{b:>8}" for b in backends))
+        for name, times in rows:
+            cols = []
+            for b in backends:
+                t = times.get(b)
+                if t is None:
+                    cols.append(f"{'failed':>8}")
+                else:
+                    totals[b] += t
+                    cols.append(f"{t:8.3f}")
+            print(f"  {name:<{width}}", *cols)
+        print(f"  {'total':<{width}}", *(f"{totals[b]:8.3f}" for b in backends))
+
     def finalize_extension(self):
         if self.extension is None:
             return
@@ -760,6 +1405,44 @@ class Wrapper:
         self.extension.libraries = self._all_library_names()
         self.extension.extra_objects = self._all_extra_objects()
 
+    def get_generated_sources(self) -> List[str]:
+        """Sources added to the extension by on_build_gen"""
+        return list(self._gen_sources)
+
+    def write_pch_header(self) -> Optional[str]:
+        """
+        Writes a header that includes robotpy_build.h and the type caster
+        headers that every generated source includes, so that it can be
+        precompiled. Including a type caster in a source that doesn't use it
+        can change how that source converts types (such as a type made
+        opaque with PYBIND11_MAKE_OPAQUE), so other type casters aren't
+        included. Returns None if nothing was generated.
+        """
+        if not self._gen_includes:
+            return None
+
+        shared_includes: Optional[Set[str]] = None
+        for includes in self._gen_caster_includes.values():
+            if shared_includes is None:
+                shared_includes = set(includes)
+            else:
+                shared_includes.intersection_update(includes)
+
+        fname = join(self._gen_includes[0], "rpygen_pch.h")
+        content = [
+            "// This file is autogenerated. DO NOT EDIT\n",
+            "\n",
+            "#include <robotpy_build.h>\n",
+            "#include <type_traits>\n",
+        ]
+        if shared_includes:
+            content.append("\n")
+            for inc in sorted(shared_includes):
+                content.append(f"#include <{inc}>\n")
+
+        self.wwriter.write_file(fname, "".join(content))
+        return fname
+
     def _write_wrapper_hpp(self, outdir, classdeps):
         decls = []
         begin_calls = []
@@ -827,5 +1510,4 @@ class Wrapper:
             .replace("##FINISH_CALLS##", "\n".join(finish_calls))
         )
 
-        with open(join(outdir, "rpygen_wrapper.hpp"), "w") as fp:
-            fp.write(content)
+        self.wwriter.write_file(join(outdir, "rpygen_wrapper.hpp"), content)
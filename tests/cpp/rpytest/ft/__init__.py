@@ -64,6 +64,16 @@ from ._rpytest_ft import (
     PrivateAbstract,
     RenamedClass,
     RenamedEnum,
+    ShardedByClass1,
+    ShardedByClass2,
+    ShardedByClass3,
+    ShardedByClassLarge,
+    ShardedByClassTmplInt,
+    ShardedEnum,
+    ShardedLarge,
+    ShardedSmall1,
+    ShardedSmall2,
+    ShardedSmall3,
     StaticOnly,
     StripPrefixEnum,
     StructWithBitfields,
@@ -114,6 +124,7 @@ from ._rpytest_ft import (
     fnSimpleDefaultParam,
     get123,
     important_retval,
+    sharded_fn,
     subpkg,
 )
 
@@ -180,6 +191,16 @@ __all__ = [
     "PrivateAbstract",
     "RenamedClass",
     "RenamedEnum",
+    "ShardedByClass1",
+    "ShardedByClass2",
+    "ShardedByClass3",
+    "ShardedByClassLarge",
+    "ShardedByClassTmplInt",
+    "ShardedEnum",
+    "ShardedLarge",
+    "ShardedSmall1",
+    "ShardedSmall2",
+    "ShardedSmall3",
     "StaticOnly",
     "StripPrefixEnum",
     "StructWithBitfields",
@@ -230,6 +251,7 @@ __all__ = [
     "fnSimpleDefaultParam",
     "get123",
     "important_retval",
+    "sharded_fn",
     "subpkg",
 ]
 
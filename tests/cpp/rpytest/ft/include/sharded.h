@@ -0,0 +1,39 @@
+#pragma once
+
+// Split into two files by the estimated size of each class: the small
+// classes are bound in the main file, and ShardedLarge in the other
+
+struct ShardedSmall1 {
+    virtual ~ShardedSmall1() {}
+    virtual int get1() const { return 1; }
+};
+
+struct ShardedSmall2 {
+    virtual ~ShardedSmall2() {}
+    virtual int get2() const { return 2; }
+};
+
+struct ShardedSmall3 : ShardedSmall1 {
+    int get3() const { return 3; }
+};
+
+struct ShardedLarge : ShardedSmall2 {
+    int m1() const { return 1; }
+    int m2() const { return 2; }
+    int m3() const { return 3; }
+    int m4() const { return 4; }
+    int m5() const { return 5; }
+    int m6() const { return 6; }
+    int m7() const { return 7; }
+    int m8() const { return 8; }
+    int m9() const { return 9; }
+    int m10() const { return 10; }
+    int m11() const { return 11; }
+    int m12() const { return 12; }
+};
+
+enum ShardedEnum {
+    SHARDED_ONE = 1,
+};
+
+inline int sharded_fn() { return 4; }
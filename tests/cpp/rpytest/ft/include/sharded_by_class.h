@@ -0,0 +1,31 @@
+#pragma once
+
+// Split into two files with about the same number of classes in each:
+// ShardedByClass1 and ShardedByClass2 are bound in the main file, and the
+// rest (including the template instance) in the other
+
+struct ShardedByClass1 {
+    virtual ~ShardedByClass1() {}
+    virtual int get1() const { return 1; }
+};
+
+struct ShardedByClass2 {
+    virtual ~ShardedByClass2() {}
+    virtual int get2() const { return 2; }
+};
+
+struct ShardedByClass3 : ShardedByClass1 {
+    int get3() const { return 3; }
+};
+
+struct ShardedByClassLarge : ShardedByClass2 {
+    int m1() const { return 1; }
+    int m2() const { return 2; }
+    int m3() const { return 3; }
+    int m4() const { return 4; }
+};
+
+template <typename T>
+struct ShardedByClassTmpl {
+    T get(T v) const { return v; }
+};
@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+
+import pytest
+
+from robotpy_build.command.compile_scheduler import (
+    CompileHistory,
+    CompileScheduler,
+    JobServer,
+)
+
+MB = 1024 * 1024
+
+
+class Tracker:
+    """Records the order that fake jobs start in and how many run at once"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.started = []
+        self.finished = []
+        self.running = 0
+        self.max_running = 0
+
+    def job(self, name, duration=0.02, peak_rss=0, fail=False):
+        def _run():
+            with self.lock:
+                self.started.append(name)
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            try:
+                time.sleep(duration)
+                if fail:
+                    raise RuntimeError(f"{name} failed")
+                return peak_rss
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.finished.append(name)
+
+        return name, _run
+
+
+def _read_tokens(rfd):
+    os.set_blocking(rfd, False)
+    try:
+        return os.read(rfd, 100)
+    except BlockingIOError:
+        return b""
+    finally:
+        os.set_blocking(rfd, True)
+
+
+def test_max_jobs():
+    t = Tracker()
+    CompileScheduler(3).run([t.job(f"s{i}") for i in range(10)])
+    assert sorted(t.finished) == sorted(f"s{i}" for i in range(10))
+    assert t.max_running == 3
+
+
+def test_first_error_stops_new_jobs():
+    t = Tracker()
+    jobs = [t.job("fail", duration=0.01, fail=True), t.job("slow", duration=0.2)]
+    jobs += [t.job(f"s{i}") for i in range(5)]
+
+    with pytest.raises(RuntimeError, match="fail failed"):
+        CompileScheduler(2).run(jobs)
+
+    # the job that was already running is finished, but nothing else starts
+    assert sorted(t.started) == ["fail", "slow"]
+    assert sorted(t.finished) == ["fail", "slow"]
+
+
+def test_jobserver_tokens_returned():
+    rfd, wfd = os.pipe()
+    try:
+        os.write(wfd, b"ab")
+        t = Tracker()
+        CompileScheduler(8, JobServer(rfd, wfd)).run([t.job(f"s{i}") for i in range(8)])
+
+        # one implicit job plus a job for each token
+        assert t.max_running == 3
+        assert sorted(_read_tokens(rfd)) == sorted(b"ab")
+    finally:
+        os.close(rfd)
+        os.close(wfd)
+
+
+def test_jobserver_tokens_returned_on_error():
+    rfd, wfd = os.pipe()
+    try:
+        os.write(wfd, b"ab")
+        t = Tracker()
+        jobs = [t.job("slow1", 0.1), t.job("slow2", 0.1), t.job("fail", fail=True)]
+        with pytest.raises(RuntimeError):
+            CompileScheduler(3, JobServer(rfd, wfd)).run(jobs)
+        assert sorted(_read_tokens(rfd)) == sorted(b"ab")
+    finally:
+        os.close(rfd)
+        os.close(wfd)
+
+
+def test_jobserver_from_environ(monkeypatch, tmp_path):
+    monkeypatch.setenv("MAKEFLAGS", "-j4")
+    assert JobServer.from_environ() is None
+
+    rfd, wfd = os.pipe()
+    try:
+        monkeypatch.setenv("MAKEFLAGS", f" -j4 --jobserver-auth={rfd},{wfd}")
+        js = JobServer.from_environ()
+        assert (js.rfd, js.wfd) == (rfd, wfd)
+        # make's file descriptors are left open
+        js.close()
+        os.fstat(rfd)
+    finally:
+        os.close(rfd)
+        os.close(wfd)
+
+    # a recipe that isn't marked with '+' doesn't get make's descriptors
+    monkeypatch.setenv("MAKEFLAGS", " -j4 --jobserver-auth=1020,1021")
+    with pytest.raises(OSError):
+        JobServer.from_environ()
+
+    fifo = tmp_path / "fifo"
+    os.mkfifo(fifo)
+    monkeypatch.setenv("MAKEFLAGS", f" -j4 --jobserver-auth=fifo:{fifo}")
+    js = JobServer.from_environ()
+    fd = js.rfd
+    js.close()
+    with pytest.raises(OSError):
+        os.fstat(fd)
+
+
+def test_memory_budget(tmp_path):
+    history = CompileHistory(str(tmp_path / "history.json"))
+    for i in range(6):
+        history.record(f"s{i}", None, 1.0, 100 * MB)
+
+    t = Tracker()
+    CompileScheduler(6, memory_budget=250 * MB, history=history).run(
+        [t.job(f"s{i}", peak_rss=100 * MB) for i in range(6)]
+    )
+    assert t.max_running == 2
+
+
+def test_memory_budget_always_runs_one(tmp_path):
+    history = CompileHistory(str(tmp_path / "history.json"))
+    history.record("big", None, 1.0, 1000 * MB)
+
+    t = Tracker()
+    CompileScheduler(4, memory_budget=100 * MB, history=history).run(
+        [t.job("big"), t.job("small")]
+    )
+    assert sorted(t.finished) == ["big", "small"]
+
+
+def test_history_roundtrip(tmp_path):
+    fname = str(tmp_path / "history.json")
+    src = tmp_path / "a.cpp"
+    src.write_text("int a;")
+
+    t = Tracker()
+    CompileScheduler(1, history=CompileHistory(fname)).run(
+        [t.job(str(src), peak_rss=5 * MB), ("up_to_date", lambda: None)]
+    )
+
+    history = CompileHistory(fname)
+    assert history.get_peak_rss(str(src)) == 5 * MB
+    # nothing is recorded for jobs that didn't compile anything
+    assert "up_to_date" not in history.sources
+
+    # a renamed source with the same content uses the recorded time
+    duration = history.sources[str(src)]["duration"]
+    src_hash = history.sources[str(src)]["hash"]
+    assert history.get_duration(str(tmp_path / "b.cpp"), src_hash) == duration
+    # a changed source uses the time recorded for its old content
+    assert history.get_duration(str(src), "changed") == duration
+    assert history.get_duration(str(tmp_path / "c.cpp"), "changed") is None
+
+
+def test_longest_first(tmp_path):
+    history = CompileHistory(str(tmp_path / "history.json"))
+    for name, duration in [("short", 1.0), ("long", 10.0), ("medium", 5.0)]:
+        history.record(name, None, duration, 0)
+
+    t = Tracker()
+    jobs = [t.job(name) for name in ("short", "new", "medium", "long")]
+    CompileScheduler(2, history=history).run(jobs)
+
+    # sources without a recorded time are started first
+    assert sorted(t.started[:2]) == ["long", "new"]
+    assert t.started[2:] == ["medium", "short"]
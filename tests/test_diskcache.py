@@ -0,0 +1,22 @@
+import threading
+
+from robotpy_build.diskcache import DiskCache
+
+
+def test_put_pickle_roundtrip(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), 1024 * 1024)
+    cache.put_pickle("abcdef", {"a": [1, 2]})
+    assert cache.get_pickle("abcdef") == {"a": [1, 2]}
+    assert cache.get_pickle("abcdeg") is None
+
+
+def test_put_pickle_failure(tmp_path, capsys):
+    cache = DiskCache(str(tmp_path / "cache"), 1024 * 1024)
+
+    # locks can't be pickled, but that shouldn't stop anything
+    cache.put_pickle("abcdef", threading.Lock())
+    assert cache.get_pickle("abcdef") is None
+    assert "WARNING: could not write to cache" in capsys.readouterr().out
+
+    # and the partially written file is removed
+    assert list((tmp_path / "cache").rglob("*")) == [tmp_path / "cache" / "ab"]
@@ -1,4 +1,5 @@
 from rpytest import ft
+import pathlib
 import pytest
 import re
 
@@ -170,6 +171,84 @@ def test_operators_eq2():
     assert o1 != o2
 
 
+#
+# sharded.h / sharded_by_class.h
+#
+
+
+def test_sharded():
+    assert ft.ShardedSmall1().get1() == 1
+    assert ft.ShardedSmall2().get2() == 2
+
+    # bases are bound in a different file
+    s3 = ft.ShardedSmall3()
+    assert isinstance(s3, ft.ShardedSmall1)
+    assert s3.get1() == 1
+    assert s3.get3() == 3
+
+    large = ft.ShardedLarge()
+    assert isinstance(large, ft.ShardedSmall2)
+    assert large.get2() == 2
+    assert large.m1() == 1
+    assert large.m12() == 12
+
+    # globals are always bound in the main file
+    assert ft.ShardedEnum.SHARDED_ONE == 1
+    assert ft.sharded_fn() == 4
+
+
+def test_sharded_by_class():
+    c3 = ft.ShardedByClass3()
+    assert isinstance(c3, ft.ShardedByClass1)
+    assert c3.get1() == 1
+    assert c3.get3() == 3
+
+    large = ft.ShardedByClassLarge()
+    assert isinstance(large, ft.ShardedByClass2)
+    assert large.get2() == 2
+    assert large.m4() == 4
+
+    assert ft.ShardedByClassTmplInt().get(5) == 5
+
+
+def _gensrc(name: str) -> str:
+    # only available when the test project was built in place
+    root = pathlib.Path(__file__).parent / "cpp" / "build"
+    for path in root.glob(f"temp.*/gensrc/rpytest_ft/{name}"):
+        return path.read_text()
+    pytest.skip("generated sources of the test project not found")
+
+
+@pytest.mark.parametrize(
+    "hname, main_classes, shard_classes",
+    [
+        # by estimated size, ShardedLarge is bigger than the rest put together
+        (
+            "sharded",
+            ["ShardedSmall1", "ShardedSmall2", "ShardedSmall3"],
+            ["ShardedLarge"],
+        ),
+        # by class, the classes are divided evenly
+        (
+            "sharded_by_class",
+            ["ShardedByClass1", "ShardedByClass2"],
+            ["ShardedByClass3", "ShardedByClassLarge", "ShardedByClassTmplInt"],
+        ),
+    ],
+)
+def test_shard_contents(hname, main_classes, shard_classes):
+    main = _gensrc(f"{hname}.cpp")
+    shard = _gensrc(f"{hname}_shard1.cpp")
+
+    for cls in main_classes:
+        assert f'"{cls}"' in main
+        assert f'"{cls}"' not in shard
+
+    for cls in shard_classes:
+        assert f'"{cls}"' in shard
+        assert f'"{cls}"' not in main
+
+
 #
 # static_only.h
 #
@@ -0,0 +1,134 @@
+#
+# Checks that build_gen only regenerates headers whose inputs changed, using
+# a small project created for each test
+#
+
+import json
+import os
+import pathlib
+import re
+import subprocess
+import sys
+
+import pytest
+
+PYPROJECT = """
+[tool.robotpy-build]
+base_package = "gentest"
+
+[tool.robotpy-build.wrappers."gentest"]
+name = "gentest_ext"
+generation_data = "gen"
+generate = [
+    { a = "a.h" },
+    { b = "b.h" },
+]
+
+[tool.robotpy-build.metadata]
+name = "gentest"
+description = "robotpy-build incremental generation test"
+author = "RobotPy Development Team"
+author_email = "robotpy@googlegroups.com"
+url = "https://github.com/robotpy/robotpy-build"
+license = "BSD-3-Clause"
+install_requires = []
+"""
+
+
+@pytest.fixture
+def project(tmp_path: pathlib.Path) -> pathlib.Path:
+    root = tmp_path / "project"
+    include = root / "gentest" / "include"
+    include.mkdir(parents=True)
+    (root / "gen").mkdir()
+    (root / "gentest" / "__init__.py").write_text("")
+    (root / "pyproject.toml").write_text(PYPROJECT)
+    (root / "setup.py").write_text("from robotpy_build.setup import setup\n\nsetup()\n")
+    (include / "a.h").write_text("struct A { int get() { return 1; } };\n")
+    (include / "b.h").write_text("struct B { int get() { return 2; } };\n")
+    return root
+
+
+def build_gen(root: pathlib.Path, *args: str, **env_vars: str):
+    """Returns (headers generated, total headers, parsed headers)"""
+    env = dict(os.environ)
+    env["RPYBUILD_CACHE_DIR"] = str(root.parent / "cache")
+    env["RPYBUILD_GEN_TIMINGS_TOP"] = "0"
+    env.pop("RPYBUILD_GEN_FILTER", None)
+    env.pop("RPYBUILD_UNITY", None)
+    env.update(env_vars)
+
+    output = subprocess.run(
+        [sys.executable, "setup.py", "build_gen", *args],
+        cwd=root,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        check=True,
+    ).stdout
+
+    m = re.search(r"gentest_ext: generating (\d+) of (\d+) headers", output)
+    assert m, output
+
+    # headers that were loaded from the parsed header cache aren't parsed
+    (timings,) = root.glob("build/temp.*/gensrc/gentest_ext/rpygen_timings.json")
+    with open(timings) as fp:
+        headers = json.load(fp)["headers"]
+    parsed = sorted(n for n, h in headers.items() if "parse" in h["phases"])
+
+    return int(m.group(1)), int(m.group(2)), parsed
+
+
+def test_incremental_gen(project: pathlib.Path):
+    assert build_gen(project) == (2, 2, ["a", "b"])
+
+    # nothing changed
+    generated, total, _ = build_gen(project)
+    assert (generated, total) == (0, 2)
+
+    # only the mtime changed
+    (project / "gentest" / "include" / "a.h").touch()
+    generated, total, _ = build_gen(project)
+    assert (generated, total) == (0, 2)
+
+    # the content of a header changed
+    (project / "gentest" / "include" / "b.h").write_text(
+        "struct B { int get() { return 3; } };\n"
+    )
+    assert build_gen(project) == (1, 2, ["b"])
+
+    # the generation data of a header changed
+    (project / "gen" / "a.yml").write_text("classes:\n  A:\n    methods:\n      get:\n")
+    assert build_gen(project) == (1, 2, ["a"])
+
+
+def test_force_uses_parsed_cache(project: pathlib.Path):
+    assert build_gen(project) == (2, 2, ["a", "b"])
+
+    # everything is generated again, but the headers haven't changed so
+    # they don't need to be parsed again
+    assert build_gen(project, "--force") == (2, 2, [])
+
+
+def test_unity_opt_out(project: pathlib.Path):
+    (project / "pyproject.toml").write_text(
+        PYPROJECT.replace('{ b = "b.h" },', '{ b = "b.h" },\n    { c = "c.h" },')
+    )
+    (project / "gentest" / "include" / "c.h").write_text(
+        "struct C { int get() { return 3; } };\n"
+    )
+    (project / "gen" / "b.yml").write_text("unity: false\n")
+
+    assert build_gen(project, RPYBUILD_UNITY="1") == (3, 3, ["a", "b", "c"])
+
+    (gensrc,) = project.glob("build/temp.*/gensrc/gentest_ext")
+    (unity_fname,) = gensrc.glob("rpygen_unity*.cpp")
+    assert unity_fname.read_text().splitlines()[-2:] == [
+        '#include "a.cpp"',
+        '#include "c.cpp"',
+    ]
+
+    # the header that isn't combined isn't put into a namespace either
+    assert "namespace rpybuild_" in (gensrc / "a.cpp").read_text()
+    assert "namespace rpybuild_" not in (gensrc / "b.cpp").read_text()
@@ -0,0 +1,46 @@
+import inspect
+
+import pytest
+
+from robotpy_build.autowrap.buffer import RenderBuffer
+
+
+def _write_lines(s: str, indent: int) -> str:
+    """What write_trim should write: the lines of inspect.cleandoc"""
+    r = RenderBuffer()
+    r.rel_indent(indent)
+    for line in inspect.cleandoc(s).splitlines(False):
+        r.writeln(line)
+    return r.getvalue()
+
+
+@pytest.mark.parametrize("indent", [0, 2])
+@pytest.mark.parametrize(
+    "s",
+    [
+        "",
+        "   ",
+        "  single line  ",
+        "\n    a\n      b\n\n    c\n  ",
+        # lines that only contain the indentation
+        "\n    a\n    \n    \n    b\n    ",
+        # whitespace only lines that are longer than the indentation
+        "\n    a\n      \n    b\n      ",
+        # the first line is kept
+        "first\n    a\n    b",
+        # the second line isn't the least indented
+        "\n      a\n    b\n",
+        "\n    a\nb",
+        "\n\n    a\n",
+        # tabs and other whitespace
+        "\n\ta\n\tb\n",
+        "\n    a\r\n    b\n",
+        "\n    a\x0c\n    b\n",
+        "\n    é\n    b\n",
+    ],
+)
+def test_write_trim(s: str, indent: int):
+    r = RenderBuffer()
+    r.rel_indent(indent)
+    r.write_trim(s)
+    assert r.getvalue() == _write_lines(s, indent)